@@ -6,4 +6,8 @@ except importlib.metadata.PackageNotFoundError:
 
 
 from .bpe_tokenizer import BPETokenizer
-from .bpe_word import Word
+from .bpe_word import Word, WordBatch
+from .pair_heap import PairHeap
+from .pair_index import PairIndex
+from .bpe_compact import CompactTokenTable, pack_pair, unpack_pair
+from .bpe_encoder import BPEEncoder, LRUCache
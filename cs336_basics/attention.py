@@ -0,0 +1,172 @@
+import math
+
+import torch
+from torch import Tensor
+
+DEFAULT_BLOCK_SIZE = 256
+
+def scaled_dot_product_attention(Q: Tensor, K: Tensor, V: Tensor, mask: Tensor | None = None, is_causal: bool = False,
+                                 block_size: int = DEFAULT_BLOCK_SIZE) -> Tensor:
+    '''
+    softmax(Q K^T / sqrt(d_k)) V over shapes (..., queries, d_k), (..., keys, d_k), (..., keys, d_v).
+    mask (..., queries, keys) is True where a query may attend to a key, is_causal additionally masks
+    keys after the query, aligning the last query with the last key.
+    queries and keys are tiled into block_size blocks, each query block sees the key blocks with an online softmax:
+    a running max, normalizer and output per query are rescaled as each key block arrives, so only
+    (..., block_size, block_size) scores exist at once. tiles no query may attend to are skipped
+    '''
+    num_queries, num_keys = Q.shape[-2], K.shape[-2]
+    batch_shape = torch.broadcast_shapes(Q.shape[:-2], K.shape[:-2], V.shape[:-2])
+    out = Q.new_empty((*batch_shape, num_queries, V.shape[-1]))
+    # position of the first query among the keys, for is_causal
+    offset = num_keys - num_queries
+    for q_sta in range(0, num_queries, block_size):
+        q_end = min(q_sta + block_size, num_queries)
+        block_mask = mask
+        # a mask broadcast over queries applies to every query block as is
+        if mask is not None and mask.shape[-2] != 1:
+            block_mask = mask[..., q_sta:q_end, :]
+        out[..., q_sta:q_end, :] = _attend_query_block(
+            Q[..., q_sta:q_end, :], K, V, block_mask, q_sta + offset if is_causal else None, block_size
+        )
+    return out
+
+def _attend_query_block(Q: Tensor, K: Tensor, V: Tensor, mask: Tensor | None, causal_start: int | None,
+                        block_size: int) -> Tensor:
+    '''
+    attention of one block of queries over all keys, causal_start is the key position of the first query
+    when attention is causal
+    '''
+    num_queries, num_keys = Q.shape[-2], K.shape[-2]
+    scale = 1.0 / math.sqrt(Q.shape[-1])
+    batch_shape = torch.broadcast_shapes(Q.shape[:-2], K.shape[:-2], V.shape[:-2])
+    row_max = Q.new_full((*batch_shape, num_queries, 1), -math.inf)
+    normalizer = Q.new_zeros((*batch_shape, num_queries, 1))
+    out = Q.new_zeros((*batch_shape, num_queries, V.shape[-1]))
+    if causal_start is not None:
+        # keys after the last query are never attended to
+        num_keys = min(num_keys, causal_start + num_queries)
+    for sta in range(0, num_keys, block_size):
+        end = min(sta + block_size, num_keys)
+        block_mask = mask[..., sta:end] if mask is not None else None
+        if causal_start is not None and end - 1 > causal_start:
+            # only tiles crossing the diagonal need a causal mask
+            query_positions = torch.arange(causal_start, causal_start + num_queries, device=Q.device)
+            causal = query_positions[:, None] >= torch.arange(sta, end, device=Q.device)
+            block_mask = causal if block_mask is None else block_mask & causal
+        if block_mask is not None and not block_mask.any():
+            continue
+        scores = Q @ K[..., sta:end, :].transpose(-1, -2) * scale
+        if block_mask is not None:
+            scores = scores.masked_fill(~block_mask, -math.inf)
+        new_max = torch.maximum(row_max, scores.amax(dim=-1, keepdim=True))
+        # rows with nothing to attend to so far keep a max of -inf, shift them by 0 instead to avoid inf - inf
+        shift = new_max.masked_fill(new_max == -math.inf, 0.0)
+        probs = torch.exp(scores - shift)
+        correction = torch.exp(row_max - shift)
+        normalizer = normalizer * correction + probs.sum(dim=-1, keepdim=True)
+        out = out * correction + probs @ V[..., sta:end, :]
+        row_max = new_max
+    # like a plain softmax, a query that may attend to no key gets nan
+    return out / normalizer
+
+def multihead_self_attention(in_features: Tensor, q_proj_weight: Tensor, k_proj_weight: Tensor, v_proj_weight: Tensor,
+                             o_proj_weight: Tensor, num_heads: int, block_size: int = DEFAULT_BLOCK_SIZE,
+                             theta: float | None = None, token_positions: Tensor | None = None,
+                             kv_cache: 'KVCache | None' = None) -> Tensor:
+    '''
+    causal multi-head self-attention over in_features (..., sequence_length, d_in).
+    the q, k and v projections of all heads are computed with one matrix multiply.
+    with theta, queries and keys are rotated by RoPE at token_positions (..., sequence_length), which default to
+    the positions following the tokens already in kv_cache.
+    with kv_cache, the new keys and values are appended to it and the queries attend to everything cached,
+    so decoding one token is a single-position forward pass
+    '''
+    qkv_weight = torch.cat([q_proj_weight, k_proj_weight, v_proj_weight])
+    Q, K, V = (in_features @ qkv_weight.T).split([len(q_proj_weight), len(k_proj_weight), len(v_proj_weight)], dim=-1)
+    Q, K, V = (split_heads(x, num_heads) for x in (Q, K, V))
+    if theta is not None:
+        if token_positions is None:
+            start = kv_cache.length if kv_cache is not None else 0
+            token_positions = torch.arange(start, start + in_features.shape[-2], device=in_features.device)
+        # the same positions for every head
+        head_positions = token_positions.unsqueeze(-2)
+        Q = rope(Q, head_positions, theta)
+        K = rope(K, head_positions, theta)
+    if kv_cache is not None:
+        K, V = kv_cache.append(K, V)
+    out = scaled_dot_product_attention(Q, K, V, is_causal=True, block_size=block_size)
+    return merge_heads(out) @ o_proj_weight.T
+
+def rope(x: Tensor, token_positions: Tensor, theta: float) -> Tensor:
+    '''
+    rotates each pair (x[..., 2i], x[..., 2i + 1]) of x (..., sequence_length, d_k) by token_position * theta ** (-2i / d_k),
+    token_positions (..., sequence_length) broadcasts against the leading dimensions of x
+    '''
+    d_k = x.shape[-1]
+    inv_freq = theta ** (-torch.arange(0, d_k, 2, device=x.device, dtype=torch.float32) / d_k)
+    angles = token_positions.to(torch.float32).unsqueeze(-1) * inv_freq
+    cos, sin = angles.cos().to(x.dtype), angles.sin().to(x.dtype)
+    even, odd = x[..., 0::2], x[..., 1::2]
+    return torch.stack([even * cos - odd * sin, even * sin + odd * cos], dim=-1).flatten(-2)
+
+
+class KVCache:
+    '''
+    keys and values of one attention layer for incremental decoding, in buffers of
+    (batch_size, num_heads, max_seq_len, d_head) allocated once. append writes the new positions in place
+    and returns views of everything cached so far
+    '''
+    def __init__(self, batch_size: int, num_heads: int, max_seq_len: int, d_head: int,
+                 dtype: torch.dtype = torch.float32, device: str | torch.device | None = None):
+        self.keys = torch.empty(batch_size, num_heads, max_seq_len, d_head, dtype=dtype, device=device)
+        self.values = torch.empty_like(self.keys)
+        self.length = 0
+
+    @classmethod
+    def for_layers(cls, num_layers: int, *args, **kwargs) -> list['KVCache']:
+        '''
+        one cache per layer of a model
+        '''
+        return [cls(*args, **kwargs) for _ in range(num_layers)]
+
+    @property
+    def max_seq_len(self) -> int:
+        return self.keys.shape[-2]
+
+    def append(self, keys: Tensor, values: Tensor) -> tuple[Tensor, Tensor]:
+        '''
+        keys and values are (batch_size, num_heads, new positions, d_head), of the cache's dtype and device
+        '''
+        batch_size, num_heads, _, d_head = self.keys.shape
+        for name, new in (('keys', keys), ('values', values)):
+            if new.dim() != 4 or new.shape[:2] != (batch_size, num_heads) or new.shape[-1] != d_head:
+                raise ValueError(f'KVCache expects {name} of shape ({batch_size}, {num_heads}, seq, {d_head}), '
+                                 f'got {tuple(new.shape)}')
+            if new.dtype != self.keys.dtype or new.device != self.keys.device:
+                raise ValueError(f'KVCache holds {self.keys.dtype} on {self.keys.device}, '
+                                 f'got {name} of {new.dtype} on {new.device}')
+        if keys.shape[-2] != values.shape[-2]:
+            raise ValueError(f'KVCache got {keys.shape[-2]} key positions but {values.shape[-2]} value positions')
+        end = self.length + keys.shape[-2]
+        if end > self.max_seq_len:
+            raise ValueError(f'KVCache holds at most {self.max_seq_len} positions, got {end}')
+        self.keys[..., self.length:end, :] = keys
+        self.values[..., self.length:end, :] = values
+        self.length = end
+        return self.keys[..., :end, :], self.values[..., :end, :]
+
+    def reset(self):
+        self.length = 0
+
+def split_heads(x: Tensor, num_heads: int) -> Tensor:
+    '''
+    (..., seq, heads * d_head) -> (..., heads, seq, d_head)
+    '''
+    return x.unflatten(-1, (num_heads, -1)).transpose(-3, -2)
+
+def merge_heads(x: Tensor) -> Tensor:
+    '''
+    (..., heads, seq, d_head) -> (..., seq, heads * d_head)
+    '''
+    return x.transpose(-3, -2).flatten(-2)
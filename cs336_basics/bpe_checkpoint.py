@@ -0,0 +1,50 @@
+import logging
+import os
+import pickle
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_PREFIX = 'merge_'
+# older checkpoints are deleted once this many newer ones exist
+KEEP_CHECKPOINTS = 2
+
+def _checkpoint_path(checkpoint_dir: str | os.PathLike, num_merges: int) -> Path:
+    return Path(checkpoint_dir) / f'{CHECKPOINT_PREFIX}{num_merges:08d}.pkl'
+
+def list_merge_checkpoints(checkpoint_dir: str | os.PathLike) -> list[Path]:
+    '''
+    returns the checkpoints in checkpoint_dir, oldest first
+    '''
+    checkpoint_dir = Path(checkpoint_dir)
+    if not checkpoint_dir.is_dir():
+        return []
+    return sorted(checkpoint_dir.glob(f'{CHECKPOINT_PREFIX}*.pkl'))
+
+def save_merge_checkpoint(checkpoint_dir: str | os.PathLike, state: dict) -> Path:
+    '''
+    writes the merge state of BPE training, state must hold 'merges', the checkpoint is named by their number
+    '''
+    checkpoint_path = _checkpoint_path(checkpoint_dir, len(state['merges']))
+    checkpoint_path.parent.mkdir(parents=True, exist_ok=True)
+    # write to a temporary file first, so a job killed while saving leaves the previous checkpoint intact
+    tmp_path = checkpoint_path.with_suffix(f'.{os.getpid()}.tmp')
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, checkpoint_path)
+    for old_path in list_merge_checkpoints(checkpoint_dir)[:-KEEP_CHECKPOINTS]:
+        old_path.unlink(missing_ok=True)
+    logger.info(f"Saved merge checkpoint {checkpoint_path}")
+    return checkpoint_path
+
+def load_latest_merge_checkpoint(checkpoint_dir: str | os.PathLike) -> dict | None:
+    '''
+    returns the state of the latest checkpoint in checkpoint_dir, None if there is none
+    '''
+    checkpoints = list_merge_checkpoints(checkpoint_dir)
+    if not checkpoints:
+        return None
+    with open(checkpoints[-1], 'rb') as f:
+        state = pickle.load(f)
+    logger.info(f"Loaded merge checkpoint {checkpoints[-1]}")
+    return state
@@ -0,0 +1,112 @@
+import logging
+from array import array
+from collections import Counter
+
+from .pair_index import PairIndex
+
+logger = logging.getLogger(__name__)
+
+PAIR_SHIFT = 32
+PAIR_MASK = (1 << PAIR_SHIFT) - 1
+
+def pack_pair(left: int, right: int) -> int:
+    '''
+    packs a pair of vocab ids into a single 64-bit key
+    '''
+    return (left << PAIR_SHIFT) | right
+
+def unpack_pair(key: int) -> tuple[int, int]:
+    return key >> PAIR_SHIFT, key & PAIR_MASK
+
+
+class CompactTokenTable:
+    '''
+    pre-token table for BPE training with every symbol stored as its vocab id.
+    words[i] is an array('I') of vocab ids, counts[i] its frequency, pairs are packed with pack_pair.
+    '''
+    def __init__(self, token_counts: Counter[str], byte_offset: int = 0):
+        '''
+        byte_offset: vocab id of the byte 0, i.e. the number of special tokens placed before the 256 bytes
+        '''
+        self.words: list[array] = []
+        self.counts = array('Q')
+        for token, count in token_counts.items():
+            token_bytes = token.encode('utf-8') if isinstance(token, str) else token
+            self.words.append(array('I', (byte + byte_offset for byte in token_bytes)))
+            self.counts.append(count)
+        self._index_pairs()
+
+    @classmethod
+    def from_words(cls, words: list[array], counts: array) -> 'CompactTokenTable':
+        '''
+        builds a table from words already converted to vocab ids
+        '''
+        table = cls.__new__(cls)
+        table.__setstate__({'words': words, 'counts': counts})
+        return table
+
+    def _index_pairs(self):
+        self.pair2words = PairIndex()
+        for idx, word in enumerate(self.words):
+            self.pair2words.add(idx, CompactTokenTable.word_pairs(word))
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+    def __getstate__(self) -> dict:
+        # pair2words is derived from words, it is rebuilt on unpickling instead of being stored
+        return {'words': self.words, 'counts': self.counts}
+
+    def __setstate__(self, state: dict):
+        self.words = state['words']
+        self.counts = state['counts']
+        self._index_pairs()
+
+    @staticmethod
+    def word_pairs(word: array) -> Counter[int]:
+        return Counter(pack_pair(left, right) for left, right in zip(word[:-1], word[1:]))
+
+    def pair_frequency(self) -> Counter[int]:
+        pair_counter = Counter()
+        for word, count in zip(self.words, self.counts):
+            for key, occurrences in CompactTokenTable.word_pairs(word).items():
+                pair_counter[key] += occurrences * count
+        return pair_counter
+
+    @staticmethod
+    def merge_word(word: array, left: int, right: int, new_id: int) -> array:
+        '''
+        replaces every non-overlapping (left, right) in word with new_id, scanning left to right
+        '''
+        new_word = array('I')
+        idx = 0
+        while idx < len(word):
+            if idx < len(word) - 1 and word[idx] == left and word[idx + 1] == right:
+                new_word.append(new_id)
+                idx += 2
+            else:
+                new_word.append(word[idx])
+                idx += 1
+        return new_word
+
+    def merge(self, key: int, new_id: int) -> Counter[int]:
+        '''
+        merges the pair packed in key into new_id in every word containing it.
+        updates words and pair2words, returns the change of every other pair's frequency
+        '''
+        left, right = unpack_pair(key)
+        pair_change_counter = Counter()
+        for idx in self.pair2words.tokens(key):
+            word = self.words[idx]
+            count = self.counts[idx]
+            new_word = CompactTokenTable.merge_word(word, left, right, new_id)
+            old_pairs = CompactTokenTable.word_pairs(word)
+            new_pairs = CompactTokenTable.word_pairs(new_word)
+            for pair_key, occurrences in old_pairs.items():
+                pair_change_counter[pair_key] -= occurrences * count
+            for pair_key, occurrences in new_pairs.items():
+                pair_change_counter[pair_key] += occurrences * count
+            self.pair2words.update_token(idx, old_pairs, new_pairs)
+            self.words[idx] = new_word
+        pair_change_counter.pop(key, None)
+        return pair_change_counter
@@ -0,0 +1,224 @@
+import heapq
+import logging
+from collections import OrderedDict
+from collections.abc import Iterable, Iterator
+
+import numpy as np
+
+from .special_tokens import get_splitter
+from .pretoken_pattern import get_pretoken_pattern
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_SIZE = 1 << 16
+
+class LRUCache:
+    '''
+    bounded mapping that evicts the least recently used entry, counts hits and misses
+    '''
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key) -> bool:
+        return key in self._entries
+
+    def get(self, key):
+        value = self._entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        if self.capacity <= 0:
+            return
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+class BPEEncoder:
+    '''
+    encodes text with a trained vocab and merges.
+    instead of replaying every merge in order, each pre-token is merged with a heap of (rank, position)
+    over its adjacent pairs and a linked list of its symbols, O(n log n) in the pre-token length.
+    encoded pre-tokens are kept in an LRU cache of cache_size entries, so frequent ones skip merging entirely
+    '''
+    def __init__(self, vocab: dict[int, bytes], merges: list[tuple[bytes, bytes]], special_tokens: list[str] | None, pattern: str,
+                 cache_size: int = DEFAULT_CACHE_SIZE):
+        self.vocab = vocab
+        self.special_tokens = special_tokens if special_tokens else []
+        self.pattern = pattern
+        self.pretoken_pattern = get_pretoken_pattern(pattern)
+        self.bytes2id: dict[bytes, int] = {token_bytes: idx for idx, token_bytes in vocab.items()}
+        self.byte_ids: list[int] = [self.bytes2id[bytes([byte])] for byte in range(256)]
+        # (left id, right id) -> (rank, merged id)
+        self.merge_ranks: dict[tuple[int, int], tuple[int, int]] = {}
+        for rank, (left, right) in enumerate(merges):
+            pair = (self.bytes2id[left], self.bytes2id[right])
+            if pair not in self.merge_ranks:
+                self.merge_ranks[pair] = (rank, self.bytes2id[left + right])
+        self.special_ids: dict[str, int] = {token: self.bytes2id[token.encode('utf-8')] for token in self.special_tokens}
+        self.cache = LRUCache(cache_size)
+        self.splitter = get_splitter(tuple(self.special_tokens))
+        # decode tables: id_bytes[idx] is the token's bytes, vocab_buffer[vocab_offsets[idx]:vocab_offsets[idx + 1]] the same
+        # bytes in one contiguous buffer. ids missing from vocab decode to nothing
+        self.id_bytes: list[bytes] = [vocab.get(idx, b'') for idx in range(max(vocab, default=-1) + 1)]
+        self.vocab_buffer = np.frombuffer(b''.join(self.id_bytes), dtype=np.uint8)
+        self.vocab_offsets = np.zeros(len(self.id_bytes) + 1, dtype=np.int64)
+        np.cumsum([len(token_bytes) for token_bytes in self.id_bytes], out=self.vocab_offsets[1:])
+
+    def encode_pretoken(self, token_bytes: bytes) -> list[int]:
+        ids = [self.byte_ids[byte] for byte in token_bytes]
+        if len(ids) < 2:
+            return ids
+        merge_ranks = self.merge_ranks
+        # doubly linked list over positions, a merged position absorbs its right neighbour
+        nxt = list(range(1, len(ids) + 1))
+        prv = list(range(-1, len(ids) - 1))
+        heap = []
+        for pos in range(len(ids) - 1):
+            ranked = merge_ranks.get((ids[pos], ids[pos + 1]))
+            if ranked is not None:
+                heap.append((ranked[0], pos, ids[pos], ids[pos + 1]))
+        heapq.heapify(heap)
+        while heap:
+            rank, pos, left, right = heapq.heappop(heap)
+            right_pos = nxt[pos]
+            # skip entries whose symbols changed since they were pushed
+            if ids[pos] != left or right_pos >= len(ids) or ids[right_pos] != right:
+                continue
+            ids[pos] = merge_ranks[(left, right)][1]
+            ids[right_pos] = -1
+            nxt[pos] = nxt[right_pos]
+            if nxt[pos] < len(ids):
+                prv[nxt[pos]] = pos
+                ranked = merge_ranks.get((ids[pos], ids[nxt[pos]]))
+                if ranked is not None:
+                    heapq.heappush(heap, (ranked[0], pos, ids[pos], ids[nxt[pos]]))
+            if prv[pos] >= 0:
+                ranked = merge_ranks.get((ids[prv[pos]], ids[pos]))
+                if ranked is not None:
+                    heapq.heappush(heap, (ranked[0], prv[pos], ids[prv[pos]], ids[pos]))
+        return [idx for idx in ids if idx != -1]
+
+    def _encode_ordinary(self, text: str, out: list[int]):
+        cache = self.cache
+        for pretoken in self.pretoken_pattern.findall(text):
+            # keyed by the pre-token string, so hits skip utf-8 encoding as well as merging
+            ids = cache.get(pretoken)
+            if ids is None:
+                ids = tuple(self.encode_pretoken(pretoken.encode('utf-8')))
+                cache.put(pretoken, ids)
+            out.extend(ids)
+
+    def encode(self, text: str) -> list[int]:
+        ids: list[int] = []
+        if not self.splitter:
+            self._encode_ordinary(text, ids)
+            return ids
+        for idx, segment in enumerate(self.splitter.split(text)):
+            # special tokens are at odd positions
+            if idx % 2:
+                ids.append(self.special_ids[segment])
+            elif segment:
+                self._encode_ordinary(segment, ids)
+        return ids
+
+    def _stream_cut(self, text: str) -> int:
+        '''
+        returns the end of the longest prefix of text that encodes the same whatever text follows it.
+        holds back a trailing partial special token and the last pre-token, which may still grow
+        '''
+        cut = len(text)
+        segment_start = 0
+        if self.splitter:
+            cut -= self.splitter.partial_suffix(text)
+            for re_match in self.splitter.finditer(text):
+                if re_match.start() >= cut:
+                    break
+                if re_match.end() > cut:
+                    # never cut inside a special token
+                    cut = re_match.start()
+                    break
+                segment_start = re_match.end()
+        if segment_start == cut:
+            return cut
+        last_match = None
+        for last_match in self.pretoken_pattern.finditer(text[segment_start:cut]):
+            pass
+        return segment_start + last_match.start()
+
+    def encode_iterable(self, iterable: Iterable[str]) -> Iterator[int]:
+        '''
+        lazily encodes a stream of strings, e.g. the lines of a file.
+        only the unfinished tail of the stream is buffered, so memory does not grow with its length
+        '''
+        pending = ''
+        for chunk in iterable:
+            pending += chunk
+            cut = self._stream_cut(pending)
+            if cut:
+                yield from self.encode(pending[:cut])
+                pending = pending[cut:]
+        if pending:
+            yield from self.encode(pending)
+
+    def _check_ids(self, lowest: int, highest: int):
+        if lowest < 0 or highest >= len(self.id_bytes):
+            raise KeyError(f'token ids out of range [0, {len(self.id_bytes)})')
+
+    def _gather_bytes(self, ids: np.ndarray) -> tuple[bytes, np.ndarray]:
+        '''
+        concatenates the bytes of ids with one fancy index into vocab_buffer, also returns each token's byte length
+        '''
+        ids = ids.astype(np.int64, copy=False)
+        if len(ids):
+            self._check_ids(int(ids.min()), int(ids.max()))
+        starts = self.vocab_offsets[ids]
+        lengths = self.vocab_offsets[ids + 1] - starts
+        # position k of the output reads vocab_buffer[starts[token] + k - (first output position of token)]
+        out_starts = np.cumsum(lengths) - lengths
+        positions = np.arange(int(lengths.sum()), dtype=np.int64) + np.repeat(starts - out_starts, lengths)
+        return self.vocab_buffer[positions].tobytes(), lengths
+
+    def decode_bytes(self, ids: Iterable[int] | np.ndarray) -> bytes:
+        if isinstance(ids, np.ndarray):
+            return self._gather_bytes(ids.ravel())[0]
+        ids = ids if isinstance(ids, list) else list(ids)
+        if ids:
+            # list indexing would wrap negative ids around to the end of the vocab
+            self._check_ids(min(ids), max(ids))
+        return b''.join(map(self.id_bytes.__getitem__, ids))
+
+    def decode(self, ids: Iterable[int] | np.ndarray) -> str:
+        return self.decode_bytes(ids).decode('utf-8', errors='replace')
+
+    def decode_batch(self, batch: Iterable[Iterable[int]] | np.ndarray) -> list[str]:
+        '''
+        decodes every sequence of batch, a 2d array is gathered in a single pass and then cut into rows
+        '''
+        if not isinstance(batch, np.ndarray) or batch.ndim != 2:
+            return [self.decode(ids) for ids in batch]
+        buffer, lengths = self._gather_bytes(batch.ravel())
+        row_ends = np.cumsum(lengths.reshape(batch.shape).sum(axis=1)).tolist()
+        return [buffer[sta:end].decode('utf-8', errors='replace') for sta, end in zip([0] + row_ends[:-1], row_ends)]
@@ -0,0 +1,119 @@
+import logging
+import multiprocessing
+from array import array
+from collections import Counter
+from multiprocessing.connection import Connection
+
+from .bpe_compact import CompactTokenTable
+
+logger = logging.getLogger(__name__)
+
+def _shard_worker(conn: Connection, words: list[array], counts: array):
+    '''
+    owns one shard of the pre-token table, applies the merges sent by the coordinator and returns pair-count deltas
+    '''
+    table = CompactTokenTable.from_words(words, counts)
+    conn.send(table.pair_frequency())
+    while True:
+        command, *args = conn.recv()
+        if command == 'merge':
+            pair_change_counter = table.merge(*args)
+            conn.send({key: change for key, change in pair_change_counter.items() if change})
+        elif command == 'state':
+            conn.send((table.words, table.counts))
+        elif command == 'close':
+            break
+    conn.close()
+
+
+class ShardedTokenTable:
+    '''
+    CompactTokenTable partitioned across worker processes.
+    every merge is broadcast to all shards, which apply it to their own pre-tokens concurrently,
+    and only the pair-count deltas travel back to be summed. the coordinator keeps no pre-tokens itself.
+    pickles as a plain CompactTokenTable holding all shards, e.g. when written to a merge checkpoint
+    '''
+    def __init__(self, words: list[array], counts: array, num_shards: int):
+        num_shards = max(1, min(num_shards, len(words)))
+        self._conns: list[Connection] = []
+        self._processes: list[multiprocessing.Process] = []
+        for shard in range(num_shards):
+            parent_conn, child_conn = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=_shard_worker, args=(child_conn, words[shard::num_shards], counts[shard::num_shards]), daemon=True
+            )
+            process.start()
+            child_conn.close()
+            self._conns.append(parent_conn)
+            self._processes.append(process)
+        self._pair_counts = Counter()
+        for conn in self._conns:
+            self._pair_counts.update(conn.recv())
+        logger.info(f"Started {num_shards} merge shards over {len(words)} pre-tokens")
+
+    @classmethod
+    def from_token_counts(cls, token_counts: Counter[str], byte_offset: int, num_shards: int) -> 'ShardedTokenTable':
+        words = []
+        counts = array('Q')
+        for token, count in token_counts.items():
+            token_bytes = token.encode('utf-8') if isinstance(token, str) else token
+            words.append(array('I', (byte + byte_offset for byte in token_bytes)))
+            counts.append(count)
+        return cls(words, counts, num_shards)
+
+    @classmethod
+    def from_table(cls, table: CompactTokenTable, num_shards: int) -> 'ShardedTokenTable':
+        return cls(table.words, table.counts, num_shards)
+
+    @property
+    def num_shards(self) -> int:
+        return len(self._conns)
+
+    def pair_frequency(self) -> Counter[int]:
+        return Counter(self._pair_counts)
+
+    def merge(self, key: int, new_id: int) -> Counter[int]:
+        '''
+        same as CompactTokenTable.merge, summed over all shards
+        '''
+        for conn in self._conns:
+            conn.send(('merge', key, new_id))
+        pair_change_counter = Counter()
+        for conn in self._conns:
+            pair_change_counter.update(conn.recv())
+        return pair_change_counter
+
+    def gather_words(self) -> tuple[list[array], array]:
+        '''
+        collects the words and counts of all shards
+        '''
+        words = []
+        counts = array('Q')
+        for conn in self._conns:
+            conn.send(('state',))
+        for conn in self._conns:
+            shard_words, shard_counts = conn.recv()
+            words.extend(shard_words)
+            counts.extend(shard_counts)
+        return words, counts
+
+    def __reduce__(self):
+        return CompactTokenTable.from_words, self.gather_words()
+
+    def close(self):
+        for conn in self._conns:
+            try:
+                conn.send(('close',))
+            except (BrokenPipeError, OSError):
+                pass
+            conn.close()
+        for process in self._processes:
+            process.join()
+        self._conns = []
+        self._processes = []
+
+    def __enter__(self) -> 'ShardedTokenTable':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -1,17 +1,40 @@
-from .utils import find_chunk_boundaries
-from collections import Counter, defaultdict
+from .utils import find_chunk_boundaries_mmap
+from .pair_heap import PairHeap
+from .pair_index import PairIndex
+from .bpe_compact import CompactTokenTable, PAIR_MASK, PAIR_SHIFT, unpack_pair
+from .bpe_sharded import ShardedTokenTable
+from .bpe_word import WordBatch
+from .bpe_encoder import BPEEncoder, DEFAULT_CACHE_SIZE
+from .special_tokens import get_splitter
+from .pretoken_pattern import PretokenPattern, get_pretoken_pattern
+from .bpe_checkpoint import load_latest_merge_checkpoint, save_merge_checkpoint
+from .token_counts import (
+    SerializedCounts, corpus_fingerprint, deserialize_counts, load_cached_counts, save_cached_counts, serialize_counts, tree_reduce_counts
+)
+from collections import Counter
+from collections.abc import Iterable, Iterator
 from multiprocessing import Pool
 from tqdm import tqdm
+import numpy as np
 import time
 import logging
-import regex as re
 import os
+import mmap
 
 logger = logging.getLogger(__name__)
 
+# upper bound of bytes a pretokenize worker reads at once, windows only grow past it for documents longer than it
+DEFAULT_WINDOW_SIZE = 1 << 22
+# without a target chunk size, the file is split into this many chunks per worker, so a slow chunk can't hold up the pool
+CHUNKS_PER_WORKER = 4
+
 class BPETokenizer:
-    def __init__(self, vocab_size: int, special_tokens: list[str] | None = None):
+    def __init__(self, vocab_size: int, special_tokens: list[str] | None = None, cache_size: int = DEFAULT_CACHE_SIZE):
+        '''
+        cache_size: capacity of the encoder's LRU cache of encoded pre-tokens, 0 disables it
+        '''
         self.vocab_size = vocab_size
+        self.cache_size = cache_size
         self.special_tokens = special_tokens if special_tokens else []
         self.vocab = {
             **{idx: special_token.encode('utf-8') for idx, special_token in enumerate(self.special_tokens)},
@@ -19,68 +42,241 @@ class BPETokenizer:
         }
         self.merges = []
         self.PAT = r"""'(?:[sdmt]|ll|ve|re)| ?\p{L}+| ?\p{N}+| ?[^\s\p{L}\p{N}]+|\s+(?!\S)|\s+"""
+        self._encoder: BPEEncoder | None = None
+
+    @classmethod
+    def from_vocab_merges(cls, vocab: dict[int, bytes], merges: list[tuple[bytes, bytes]], special_tokens: list[str] | None = None,
+                          cache_size: int = DEFAULT_CACHE_SIZE) -> 'BPETokenizer':
+        '''
+        builds a tokenizer from a trained vocab and merges, special tokens missing from vocab are appended to it
+        '''
+        tokenizer = cls(len(vocab), special_tokens, cache_size)
+        tokenizer.vocab = dict(vocab)
+        existing = set(tokenizer.vocab.values())
+        for special_token in tokenizer.special_tokens:
+            if special_token.encode('utf-8') not in existing:
+                tokenizer.vocab[len(tokenizer.vocab)] = special_token.encode('utf-8')
+        tokenizer.vocab_size = len(tokenizer.vocab)
+        tokenizer.merges = list(merges)
+        return tokenizer
+
+    @property
+    def encoder(self) -> BPEEncoder:
+        '''
+        lookup tables for encoding, built from vocab and merges on first use
+        '''
+        if self._encoder is None:
+            self._encoder = BPEEncoder(self.vocab, self.merges, self.special_tokens, self.PAT, self.cache_size)
+        return self._encoder
+
+    @property
+    def pretoken_pattern(self) -> PretokenPattern:
+        '''
+        PAT compiled once per process, with its ascii fast path
+        '''
+        return get_pretoken_pattern(self.PAT)
+
+    def encode(self, text: str) -> list[int]:
+        return self.encoder.encode(text)
+
+    def encode_iterable(self, iterable: Iterable[str]) -> Iterator[int]:
+        return self.encoder.encode_iterable(iterable)
+
+    def decode(self, ids: list[int] | np.ndarray) -> str:
+        return self.encoder.decode(ids)
+
+    def decode_batch(self, batch: list[list[int]] | np.ndarray) -> list[str]:
+        return self.encoder.decode_batch(batch)
     
-    def train(self, input_path: str, parallel: bool = True):
+    def train(self, input_path: str, parallel: bool = True, int_ids: bool = False, window_size: int = DEFAULT_WINDOW_SIZE,
+              num_workers: int | None = None, chunk_size: int | None = None, cache_dir: str | None = None,
+              checkpoint_dir: str | None = None, checkpoint_every: int = 1000, merge_workers: int = 1, batch_merge: bool = False):
+        '''
+        int_ids: keep the merge state as vocab ids in CompactTokenTable instead of lists of bytes,
+        bytes are only looked up when emitting vocab and merges
+        window_size: bytes each pretokenize worker reads at once, bounds its peak memory
+        num_workers: processes used by parallel pretokenization, defaults to os.cpu_count(), also sets the number of chunks
+        chunk_size: target bytes per chunk handed to a worker, defaults to CHUNKS_PER_WORKER chunks per worker
+        cache_dir: directory caching pre-token counts by corpus fingerprint, so runs that only change vocab_size skip pretokenization
+        checkpoint_dir: directory the merge state is saved to every checkpoint_every merges,
+        training resumes from the latest checkpoint found there instead of starting over
+        merge_workers: with int_ids, partitions the pre-tokens across this many processes that apply each merge concurrently
+        batch_merge: with int_ids, keeps the pre-tokens in a WordBatch, which applies each merge to every affected word
+        with vectorized numpy instead of one word at a time
+        '''
+        if merge_workers > 1 and not int_ids:
+            raise ValueError("merge_workers > 1 requires int_ids=True")
+        if batch_merge and (not int_ids or merge_workers > 1):
+            raise ValueError("batch_merge requires int_ids=True and merge_workers=1")
+        self._encoder = None
+        fingerprint = None
+        if cache_dir is not None or checkpoint_dir is not None:
+            fingerprint = corpus_fingerprint(input_path, self.PAT, self.special_tokens)
+        resume_state = None
+        if checkpoint_dir is not None:
+            resume_state = load_latest_merge_checkpoint(checkpoint_dir)
+        if resume_state is not None:
+            if resume_state['fingerprint'] != fingerprint or resume_state['int_ids'] != int_ids:
+                raise ValueError(f"Checkpoint in {checkpoint_dir} was written for another corpus, pattern, special tokens or int_ids setting")
+            self.merges = resume_state['merges']
+            self.vocab = resume_state['vocab']
+            logger.info(f"Resuming from merge checkpoint at vocab size: {len(self.vocab)}\n")
+            token_counts = None
+        else:
+            token_counts = self._pretokenize_counts(input_path, parallel, window_size, num_workers, chunk_size, cache_dir, fingerprint)
+        checkpoint = None
+        if checkpoint_dir is not None:
+            checkpoint = (checkpoint_dir, checkpoint_every, fingerprint)
+        logger.info(f"Started Merging (int_ids={int_ids})\n")
+        time_sta_merging = time.time()
+        if int_ids:
+            self._train_int_ids(token_counts, resume_state, checkpoint, merge_workers, batch_merge)
+        else:
+            self._train_bytes(token_counts, resume_state, checkpoint)
+        logger.info(f"Finsished Merging in {time.time() - time_sta_merging:.2f} seconds, vocab size: {len(self.vocab)}\n")
+
+    def _pretokenize_counts(self, input_path: str, parallel: bool, window_size: int, num_workers: int | None, chunk_size: int | None,
+                            cache_dir: str | None, fingerprint: str | None) -> Counter[str]:
         logger.info(f"Started Pretokenization: {input_path} (parallel={parallel}).\n")
         time_sta_pretokenization = time.time()
-        if parallel:
-            token_counts = BPETokenizer.pretokenize_parallel(input_path, self.PAT, self.special_tokens)
-        else:
-            token_counts = BPETokenizer.pretokenize(input_path, self.PAT, self.special_tokens)
+        token_counts = None
+        if cache_dir is not None:
+            token_counts = load_cached_counts(cache_dir, fingerprint)
+            logger.info(f"Pre-token cache {'hit' if token_counts is not None else 'miss'}: {fingerprint}")
+        if token_counts is None:
+            if parallel:
+                token_counts = BPETokenizer.pretokenize_parallel(input_path, self.PAT, self.special_tokens, window_size, num_workers, chunk_size)
+            else:
+                token_counts = BPETokenizer.pretokenize(input_path, self.PAT, self.special_tokens, window_size, num_workers, chunk_size)
+            if cache_dir is not None:
+                save_cached_counts(cache_dir, fingerprint, token_counts)
         logger.info(f"Finished Pretokenization in {time.time() - time_sta_pretokenization:.2f} seconds.\n")
-        # reform the token_counts{bytes: int} to {bytes: (List, int)}
-        token_counts, pair2tokens = BPETokenizer._reform_tokens_counts(token_counts)
-        # get the pair freqeuncy: Counter
-        pair_counts = BPETokenizer._pair_frequency(token_counts)
+        return token_counts
+
+    def _save_merge_checkpoint(self, checkpoint: tuple | None, int_ids: bool, token_table, pair_counts: Counter):
+        '''
+        saves the merge state every checkpoint_every merges, checkpoint is (checkpoint_dir, checkpoint_every, fingerprint)
+        '''
+        if checkpoint is None:
+            return
+        checkpoint_dir, checkpoint_every, fingerprint = checkpoint
+        if len(self.merges) % checkpoint_every != 0:
+            return
+        save_merge_checkpoint(checkpoint_dir, {
+            'fingerprint': fingerprint,
+            'int_ids': int_ids,
+            'merges': self.merges,
+            'vocab': self.vocab,
+            'token_table': token_table,
+            'pair_counts': pair_counts,
+        })
+
+    def _train_bytes(self, token_counts: Counter[str] | None, resume_state: dict | None = None, checkpoint: tuple | None = None):
+        if resume_state is not None:
+            token_counts = resume_state['token_table']
+            pair2tokens = BPETokenizer._index_token_pairs(token_counts)
+            pair_counts = resume_state['pair_counts']
+        else:
+            # reform the token_counts{bytes: int} to {bytes: (List, int)}
+            token_counts, pair2tokens = BPETokenizer._reform_tokens_counts(token_counts)
+            # get the pair freqeuncy: Counter
+            pair_counts = BPETokenizer._pair_frequency(token_counts)
+        pair_heap = PairHeap(pair_counts)
         vocab_size_before_train = len(self.vocab)
-        logger.info(f"Started Merging\n")
-        time_sta_merging = time.time()
         for i in tqdm(range(vocab_size_before_train, self.vocab_size)):
             if i % 100 == 0:
                 logger.info(f"Iteration {i}, vocab size: {len(self.vocab)}")
-            most_frequent_pair = max(pair_counts, key=lambda pair: (pair_counts[pair], pair))
+            most_frequent_pair = pair_heap.pop()
+            if most_frequent_pair is None:
+                logger.info(f"No pair left to merge, stopped at vocab size: {len(self.vocab)}")
+                break
             self.merges.append(most_frequent_pair)
             self.vocab[i] = most_frequent_pair[0] + most_frequent_pair[1]
-            pair_changed_counter = BPETokenizer._merge_pair_token_counts(token_counts, most_frequent_pair)
-            pair_counts.update(pair_changed_counter)
-            pair_counts.pop(most_frequent_pair)
-        logger.info(f"Finsished Merging in {time.time() - time_sta_merging:.2f} seconds, vocab size: {len(self.vocab)}\n")
-        
+            pair_changed_counter = BPETokenizer._merge_pair_token_counts(token_counts, pair2tokens, most_frequent_pair)
+            pair_heap.update(pair_changed_counter)
+            self._save_merge_checkpoint(checkpoint, False, token_counts, pair_heap.counts)
+
+    def _train_int_ids(self, token_counts: Counter[str] | None, resume_state: dict | None = None, checkpoint: tuple | None = None,
+                       merge_workers: int = 1, batch_merge: bool = False):
+        byte_offset = len(self.special_tokens)
+        if resume_state is not None:
+            table = resume_state['token_table']
+            if merge_workers > 1:
+                table = ShardedTokenTable.from_table(table, merge_workers)
+            elif batch_merge:
+                table = WordBatch.from_words(table.words, table.counts)
+            pair_counts = resume_state['pair_counts']
+        else:
+            if batch_merge:
+                table = WordBatch.from_bytes([token.encode('utf-8') if isinstance(token, str) else token for token in token_counts], list(token_counts.values()), byte_offset)
+            elif merge_workers > 1:
+                table = ShardedTokenTable.from_token_counts(token_counts, byte_offset, merge_workers)
+            else:
+                table = CompactTokenTable(token_counts, byte_offset=byte_offset)
+            pair_counts = table.pair_counts() if batch_merge else table.pair_frequency()
+        vocab = self.vocab
+        pair_heap = PairHeap(pair_counts, tiebreak=lambda key: (vocab[key >> PAIR_SHIFT], vocab[key & PAIR_MASK]))
+        vocab_size_before_train = len(self.vocab)
+        try:
+            for i in tqdm(range(vocab_size_before_train, self.vocab_size)):
+                if i % 100 == 0:
+                    logger.info(f"Iteration {i}, vocab size: {len(self.vocab)}")
+                most_frequent_key = pair_heap.pop()
+                if most_frequent_key is None:
+                    logger.info(f"No pair left to merge, stopped at vocab size: {len(self.vocab)}")
+                    break
+                left, right = unpack_pair(most_frequent_key)
+                self.merges.append((vocab[left], vocab[right]))
+                vocab[i] = vocab[left] + vocab[right]
+                if batch_merge:
+                    pair_heap.update(table.merge(left, right, i))
+                else:
+                    pair_heap.update(table.merge(most_frequent_key, i))
+                self._save_merge_checkpoint(checkpoint, True, table, pair_heap.counts)
+        finally:
+            if isinstance(table, ShardedTokenTable):
+                table.close()
 
     @staticmethod
-    def _merge_pair_token_counts(token_counts: dict[bytes, tuple[list[bytes], int]],  pair2tokens: dict[tuple[bytes, bytes], set[bytes]], pair: tuple[bytes, bytes]) -> Counter[tuple[bytes]]:
-        # merge would change token_counts[list[bytes]], pair2tokens, add some new pair, remove some pair eliminated during merge, change some pair's set
-        # update the pair_counts, without accessing to pair_counts
-        # TODO: merge list[bytes] in token_counts, find corresponding tokens from pair2tokens, then merge list[bytes] in token_counts, counts the side effect to pair2tokens, pair_counts
-        # TODO: update pair2tokens and pair_counts, using update
+    def _merge_pair_token_counts(token_counts: dict[bytes, tuple[list[bytes], int]], pair2tokens: PairIndex, pair: tuple[bytes, bytes]) -> Counter[tuple[bytes]]:
+        '''
+        merges pair in every pre-token that pair2tokens lists for it, updating token_counts and pair2tokens in place.
+        returns the change of every other pair's frequency, without accessing pair_counts,
+        the merged pair itself is gone and left to the caller to drop
+        '''
         pair_change_counter = Counter()
-        for token in pair2tokens[pair]:
+        for token in pair2tokens.tokens(pair):
             bytes_list, count = token_counts[token]
-            new_bytes_list = []
-            idx = 0
-            while idx <= len(bytes_list) - 1:
-                if idx == len(bytes_list) - 1:
-                    new_bytes_list.append(bytes_list[-1])
-                    break
-                if (bytes_list[idx], bytes_list[idx + 1]) == pair:
-                    if idx > 0:
-                        pair_change_counter[(new_bytes_list[-1], bytes_list[idx] + bytes_list[idx + 1])] += count
-                        pair2tokens[(new_bytes_list[-1], bytes_list[idx] + bytes_list[idx + 1])].add(token)
-                        pair_change_counter[(new_bytes_list[-1], bytes_list[idx])] -= count
-                        pair2tokens[(new_bytes_list[-1], bytes_list[idx])].remove(token)
-                    if idx < len(bytes_list) - 2:
-                        pair_change_counter[(bytes_list[idx] + bytes_list[idx + 1], bytes_list[idx + 2])] += count
-                        pair2tokens[(bytes_list[idx] + bytes_list[idx + 1], bytes_list[idx + 2])].add(token)
-                        pair_change_counter[(bytes_list[idx + 1], bytes_list[idx + 2])] -= count
-                        pair2tokens[(bytes_list[idx + 1], bytes_list[idx + 2])].remove(token)
-                    new_bytes_list.append(bytes_list[idx] + bytes_list[idx + 1])
-                    idx += 1
-                else:
-                    new_bytes_list.append(bytes_list[idx])
+            new_bytes_list = BPETokenizer._merge_bytes_list(bytes_list, pair)
+            old_pairs = BPETokenizer._bytes_list_pairs(bytes_list)
+            new_pairs = BPETokenizer._bytes_list_pairs(new_bytes_list)
+            for changed_pair, occurrences in old_pairs.items():
+                pair_change_counter[changed_pair] -= occurrences * count
+            for changed_pair, occurrences in new_pairs.items():
+                pair_change_counter[changed_pair] += occurrences * count
+            pair2tokens.update_token(token, old_pairs, new_pairs)
+            token_counts[token] = (new_bytes_list, count)
+        return Counter({changed_pair: change for changed_pair, change in pair_change_counter.items() if change and changed_pair != pair})
+
+    @staticmethod
+    def _merge_bytes_list(bytes_list: list[bytes], pair: tuple[bytes, bytes]) -> list[bytes]:
+        '''
+        merges every non-overlapping occurrence of pair, scanning left to right
+        '''
+        new_bytes_list = []
+        idx = 0
+        while idx < len(bytes_list):
+            if idx < len(bytes_list) - 1 and bytes_list[idx] == pair[0] and bytes_list[idx + 1] == pair[1]:
+                new_bytes_list.append(bytes_list[idx] + bytes_list[idx + 1])
+                idx += 2
+            else:
+                new_bytes_list.append(bytes_list[idx])
                 idx += 1
-                token_counts[token] = (new_bytes_list, count)
-        pair2tokens.pop(pair)
-        return pair_change_counter
+        return new_bytes_list
+
+    @staticmethod
+    def _bytes_list_pairs(bytes_list: list[bytes]) -> Counter[tuple[bytes, bytes]]:
+        return Counter(zip(bytes_list[:-1], bytes_list[1:]))
 
     @staticmethod
     def count_pair(bytes_repr: bytes):
@@ -103,52 +299,84 @@ class BPETokenizer:
         return pair_counter
     
     @staticmethod
-    def _reform_tokens_counts(token_counts: Counter[str]) -> tuple[dict[bytes, tuple[list[bytes], int]], dict[tuple[bytes,bytes], set[bytes]]]:
+    def _index_token_pairs(token_counts: dict[bytes, tuple[list[bytes], int]]) -> PairIndex:
+        pair2tokens = PairIndex()
+        for token, (bytes_list, _) in token_counts.items():
+            pair2tokens.add(token, BPETokenizer._bytes_list_pairs(bytes_list))
+        return pair2tokens
+
+    @staticmethod
+    def _reform_tokens_counts(token_counts: Counter[str]) -> tuple[dict[bytes, tuple[list[bytes], int]], PairIndex]:
         token_counts_reformed = Counter()
-        pair2tokens = defaultdict(set)
+        pair2tokens = PairIndex()
         for token, count in token_counts.items():
             token_bytes = token.encode('utf-8')
             token_counts_reformed[token_bytes] = (BPETokenizer.get_bytes_list(token_bytes), count)
-            for pair in BPETokenizer.count_pair(token_bytes):
-                pair2tokens[pair].add(token_bytes)
+            pair2tokens.add(token_bytes, BPETokenizer.count_pair(token_bytes))
         return token_counts_reformed, pair2tokens
     
     @staticmethod
-    def pretokenize(input_path:str, pattern: str, special_tokens: list[str] | None = None) -> Counter:
+    def pretokenize(input_path:str, pattern: str, special_tokens: list[str] | None = None, window_size: int = DEFAULT_WINDOW_SIZE,
+                    num_workers: int | None = None, chunk_size: int | None = None) -> Counter:
+        '''
+        pretokenizes a file chunk by chunk in this process, over the same chunks as pretokenize_parallel
+        '''
         if not special_tokens:
-            special_tokens = [r'<endoftext>']
+            special_tokens = [r'<|endoftext|>']
         token_counts = Counter()
-        with open(input_path, 'rb') as f:
-            boundaries = find_chunk_boundaries(
-                f, 64, b"<endoftext>"
-            )
+        boundaries = BPETokenizer._chunk_boundaries(input_path, special_tokens, num_workers, chunk_size)
         print("Pretokenizing without parallel... \n")
         for sta, end in tqdm(zip(boundaries[:-1], boundaries[1:])):
-            with open(input_path, 'rb') as f:
-                f.seek(sta)
-                chunk = f.read(end -sta)
-            token_counts.update(BPETokenizer.pretokenize_binary(chunk, pattern, special_tokens))
+            token_counts.update(BPETokenizer._parallel_pretokenize_worker(input_path, pattern, special_tokens, sta, end, window_size))
         return token_counts
     
     @staticmethod
-    def pretokenize_parallel(input_path: str, pattern, special_tokens: list[str] | None = None) -> Counter:
+    def pretokenize_parallel(input_path: str, pattern, special_tokens: list[str] | None = None, window_size: int = DEFAULT_WINDOW_SIZE,
+                             num_workers: int | None = None, chunk_size: int | None = None) -> Counter:
         '''
-        pretokenizes a file in parallel and returns token frequencies
+        pretokenizes a file in parallel and returns token frequencies.
+        the file is split into more chunks than workers (by chunk_size, or CHUNKS_PER_WORKER per worker),
+        chunks are handed out with imap_unordered so workers that finish early pick up the remaining ones.
+        workers send back serialized counts, which are merged by a tree reduction on the same pool
         '''
         if not special_tokens:
             special_tokens = [r'<|endoftext|>']
-        token_counts = Counter()
+        num_workers = num_workers or os.cpu_count() or 1
+        boundaries = BPETokenizer._chunk_boundaries(input_path, special_tokens, num_workers, chunk_size)
+        if len(boundaries) < 2:
+            return Counter()
+        subprocess_args = [(input_path, pattern, special_tokens, sta, end, window_size) for sta, end in zip(boundaries[:-1], boundaries[1:])]
+        logger.info(f"Pretokenizing {len(subprocess_args)} chunks with {num_workers} workers")
+        with Pool(min(num_workers, len(subprocess_args)) or 1, initializer=BPETokenizer._init_pretokenize_worker,
+                  initargs=(pattern, special_tokens)) as p:
+            results = list(p.imap_unordered(BPETokenizer._parallel_pretokenize_worker_star, subprocess_args))
+            token_counts = tree_reduce_counts(results, p)
+        return deserialize_counts(token_counts)
+
+    @staticmethod
+    def _chunk_boundaries(input_path: str, special_tokens: list[str], num_workers: int | None = None, chunk_size: int | None = None) -> list[int]:
+        '''
+        splits the file at occurrences of any of the special tokens, shared by the serial and parallel paths.
+        boundaries are then moved to the end of the special token a full scan matches there, so where special tokens
+        overlap (e.g. <|a|> and zz<|a|>) no chunk starts inside a longer one
+        '''
+        num_workers = num_workers or os.cpu_count() or 1
         with open(input_path, 'rb') as f:
-            boundaries = find_chunk_boundaries(
-                f, 64, b"<|endoftext|>"
-            )
-        subprocess_args = [(input_path, pattern, special_tokens, sta, end) for sta, end in zip(boundaries[:-1], boundaries[1:])]
-        with Pool(64) as p:
-            results = p.starmap(BPETokenizer._parallel_pretokenize_worker, subprocess_args) # 这里使用了硬编码，考虑将函数改为cls method？
-        for r in results:
-            token_counts.update(r)
-        return token_counts    
-    
+            file_size = os.fstat(f.fileno()).st_size
+            if file_size == 0:
+                return [0]
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                boundaries = find_chunk_boundaries_mmap(
+                    mm, BPETokenizer._num_chunks(file_size, num_workers, chunk_size), [token.encode('utf-8') for token in special_tokens]
+                )
+                return get_splitter(tuple(special_tokens)).snap_boundaries(mm, boundaries)
+
+    @staticmethod
+    def _num_chunks(file_size: int, num_workers: int, chunk_size: int | None = None) -> int:
+        if chunk_size:
+            return max(1, -(-file_size // chunk_size))
+        return num_workers * CHUNKS_PER_WORKER
+
     @staticmethod
     def pretokenize_binary(file: bytes, pattern: str, special_tokens: list[str] | None = None) -> Counter:
         '''
@@ -157,26 +385,70 @@ class BPETokenizer:
         if not special_tokens:
             special_tokens = [r'<|endoftext|>']
         token_counts = Counter()
+        pretoken_pattern = get_pretoken_pattern(pattern)
         chunk = file.decode('utf-8', errors='ignore')
-        chunks = re.split('|'.join(map(re.escape, special_tokens)), chunk)
-        for chunk in chunks:
-                tokens = [re_match.group() for re_match in re.finditer(pattern, chunk)]
-                counts = Counter(tokens)
-                token_counts.update(counts)
+        for chunk in get_splitter(tuple(special_tokens)).segments(chunk):
+            token_counts.update(pretoken_pattern.iter_pretokens(chunk))
         return token_counts
     
     @staticmethod
-    def _parallel_pretokenize_worker(input_path: str, pattern: str, special_tokens: list[str] | None = None, sta: int = 0, end: int = 0) -> Counter:
+    def _parallel_pretokenize_worker(input_path: str, pattern: str, special_tokens: list[str] | None = None, sta: int = 0, end: int = 0, window_size: int = DEFAULT_WINDOW_SIZE) -> Counter:
         '''
-        called by subprocesses in pretokenize_parallel, returns token frequencies
+        called by subprocesses in pretokenize_parallel, returns token frequencies.
+        maps the file and pretokenizes [sta, end) in windows of about window_size bytes, so only one window
+        is copied out of the page cache at a time
         '''
         if not special_tokens:
             special_tokens = [r'<|endoftext|>']
-        with open(input_path, 'rb') as f:
-            f.seek(sta)
-            chunk = f.read(end - sta)
-        return BPETokenizer.pretokenize_binary(chunk, pattern, special_tokens)
-                
+        token_counts = Counter()
+        if end <= sta:
+            return token_counts
+        with open(input_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for window in BPETokenizer._iter_windows(mm, sta, end, window_size, special_tokens):
+                token_counts.update(BPETokenizer.pretokenize_binary(window, pattern, special_tokens))
+        return token_counts
+
+    @staticmethod
+    def _init_pretokenize_worker(pattern: str, special_tokens: list[str]):
+        '''
+        pool initializer, compiles the pattern and special-token splitter once per worker process
+        '''
+        get_pretoken_pattern(pattern)
+        get_splitter(tuple(special_tokens))
+
+    @staticmethod
+    def _parallel_pretokenize_worker_star(args: tuple) -> SerializedCounts:
+        return serialize_counts(BPETokenizer._parallel_pretokenize_worker(*args))
+
+    @staticmethod
+    def _iter_windows(buffer: bytes | mmap.mmap, sta: int, end: int, window_size: int, special_tokens: list[str]) -> Iterator[bytes]:
+        '''
+        yields consecutive windows covering buffer[sta:end], every window but the last ends right before a special token,
+        so no pre-token (or utf-8 character) is cut in half.
+        a window is cut at the last special token starting within window_size bytes, and only grows past window_size
+        up to the next special token when there is none. the special tokens are the matches of the shared splitter,
+        as a scan of the whole buffer finds them, so a window never starts inside a longer overlapping one
+        '''
+        splitter = get_splitter(tuple(special_tokens))
+        pos = sta
+        while pos < end:
+            target = pos + window_size
+            if target >= end:
+                yield buffer[pos:end]
+                break
+            cut = None
+            for re_match in splitter.finditer_bytes(buffer, pos, end):
+                if re_match.start() <= pos:
+                    continue
+                if re_match.start() > target and cut is not None:
+                    break
+                cut = re_match.start()
+                if cut > target:
+                    break
+            cut = end if cut is None else cut
+            yield buffer[pos:cut]
+            pos = cut
+
 if __name__ == '__main__':
     
     def test_pretokenize_parallel():
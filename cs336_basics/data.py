@@ -0,0 +1,254 @@
+import logging
+import queue
+import threading
+import time
+from collections.abc import Iterator
+
+import numpy as np
+import numpy.typing as npt
+import torch
+
+logger = logging.getLogger(__name__)
+
+def sample_windows(dataset: npt.NDArray, starts: npt.NDArray, context_length: int) -> np.ndarray:
+    '''
+    gathers dataset[start:start + context_length + 1] for every start with a single fancy index,
+    on a np.memmap only the pages holding the windows are read
+    '''
+    positions = starts[:, None] + np.arange(context_length + 1)
+    return np.asarray(dataset[positions], dtype=np.int64)
+
+class PinnedStaging:
+    '''
+    pinned host buffers for host-to-device copies, one per batch shape, allocated once and reused.
+    a buffer is refilled only after the non_blocking copy that last read it has finished
+    '''
+    def __init__(self):
+        # shape -> (pinned buffer, cuda event recorded after its last copy)
+        self.buffers: dict[tuple[int, ...], tuple[torch.Tensor, torch.cuda.Event]] = {}
+
+    def to_device(self, array: np.ndarray, device: torch.device) -> torch.Tensor:
+        staged = self.buffers.get(array.shape)
+        if staged is None:
+            buffer = torch.empty(array.shape, dtype=torch.from_numpy(array[:0]).dtype, pin_memory=True)
+        else:
+            buffer, copied = staged
+            copied.synchronize()
+        buffer.copy_(torch.from_numpy(array))
+        out = buffer.to(device, non_blocking=True)
+        copied = torch.cuda.Event()
+        copied.record(torch.cuda.current_stream(device))
+        self.buffers[array.shape] = (buffer, copied)
+        return out
+
+# staging buffers per thread, so a BatchPrefetcher thread and the training loop never share one
+_pinned_staging = threading.local()
+
+def windows_to_device(windows: np.ndarray, device: str | torch.device) -> tuple[torch.Tensor, torch.Tensor]:
+    '''
+    moves (batch_size, context_length + 1) windows to device and splits them into contiguous inputs and labels.
+    for cuda the windows go through a reused pinned buffer (PinnedStaging), so the copy is asynchronous
+    with non_blocking
+    '''
+    device = torch.device(device)
+    batch = torch.from_numpy(windows)
+    if device.type == 'cuda':
+        if not hasattr(_pinned_staging, 'staging'):
+            _pinned_staging.staging = PinnedStaging()
+        batch = _pinned_staging.staging.to_device(windows, device)
+    elif device.type != 'cpu':
+        batch = batch.to(device)
+    # separate tensors, so y.view(-1) works and writing to x can't change y
+    return batch[:, :-1].contiguous(), batch[:, 1:].contiguous()
+
+def get_batch(dataset: npt.NDArray, batch_size: int, context_length: int, device: str | torch.device,
+              generator: np.random.Generator | None = None) -> tuple[torch.Tensor, torch.Tensor]:
+    '''
+    samples batch_size windows uniformly from dataset (a 1d array of token ids, e.g. a np.memmap of a token file),
+    returns inputs x and next-token labels y, LongTensors of shape (batch_size, context_length) on device
+    '''
+    num_starts = len(dataset) - context_length
+    assert num_starts > 0, f'dataset of {len(dataset)} tokens is too short for context_length {context_length}'
+    rng = generator if generator is not None else np.random.default_rng()
+    starts = rng.integers(0, num_starts, size=batch_size)
+    return windows_to_device(sample_windows(dataset, starts, context_length), device)
+
+def document_offsets(dataset: npt.NDArray, eot_id: int, block_size: int = 1 << 24) -> np.ndarray:
+    '''
+    start of every document in dataset followed by its length, a document ends with (and includes) eot_id.
+    scans dataset block by block, so a np.memmap is never copied into memory as a whole
+    '''
+    ends = [np.flatnonzero(np.asarray(dataset[sta:sta + block_size]) == eot_id) + sta + 1
+            for sta in range(0, len(dataset), block_size)]
+    ends = np.concatenate([np.zeros(0, dtype=np.int64)] + ends)
+    return np.concatenate([[0], ends[ends < len(dataset)], [len(dataset)]]).astype(np.uint64)
+
+def document_attention_mask(positions: npt.NDArray, doc_offsets: npt.NDArray) -> torch.Tensor:
+    '''
+    causal mask for windows of dataset positions, shape (batch_size, length, length).
+    mask[b, i, j] is True where position i may attend to position j: j <= i and both lie in the same document
+    '''
+    doc_ids = torch.from_numpy(np.searchsorted(doc_offsets.astype(np.int64), positions, side='right').astype(np.int64))
+    length = positions.shape[-1]
+    causal = torch.ones(length, length, dtype=torch.bool).tril()
+    return causal & (doc_ids[:, :, None] == doc_ids[:, None, :])
+
+
+class PackedSequenceSampler:
+    '''
+    samples the dataset in epochs instead of at random offsets. the dataset is cut into consecutive windows of
+    context_length + 1 tokens overlapping by one, shuffled per epoch, seeded by (seed, epoch). the last
+    (len(dataset) - 1) % context_length inputs, too few for a full window, make up one shorter window yielded as
+    the last batch of every epoch, so every token but the last is an input (and every token but the first a label)
+    exactly once per epoch. with doc_offsets (from document_offsets or the sidecar written by encode_corpus) or eot_id, batches
+    also carry a document attention mask, so no token attends across an end-of-text boundary
+    '''
+    def __init__(self, dataset: npt.NDArray, batch_size: int, context_length: int, device: str | torch.device,
+                 seed: int | None = None, doc_offsets: npt.NDArray | None = None, eot_id: int | None = None):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.context_length = context_length
+        self.device = device
+        self.seed = seed
+        self.epoch = 0
+        self.num_windows = (len(dataset) - 1) // context_length
+        assert self.num_windows > 0, f'dataset of {len(dataset)} tokens is too short for context_length {context_length}'
+        self.tail_length = (len(dataset) - 1) % context_length
+        if doc_offsets is None and eot_id is not None:
+            doc_offsets = document_offsets(dataset, eot_id)
+        self.doc_offsets = doc_offsets
+
+    def __len__(self) -> int:
+        return -(-self.num_windows // self.batch_size) + (self.tail_length > 0)
+
+    def iter_epoch(self, epoch: int) -> Iterator[tuple[torch.Tensor, ...]]:
+        '''
+        yields (x, y), or (x, y, mask) with document offsets, for every batch of epoch. the last full batch may hold
+        fewer windows, the tail window comes last as a batch of one with tail_length positions
+        '''
+        rng = np.random.default_rng(None if self.seed is None else (self.seed, epoch))
+        order = rng.permutation(self.num_windows) * self.context_length
+        for sta in range(0, self.num_windows, self.batch_size):
+            yield self._batch(order[sta:sta + self.batch_size], self.context_length)
+        if self.tail_length:
+            yield self._batch(np.array([self.num_windows * self.context_length]), self.tail_length)
+
+    def _batch(self, starts: np.ndarray, context_length: int) -> tuple[torch.Tensor, ...]:
+        x, y = windows_to_device(sample_windows(self.dataset, starts, context_length), self.device)
+        if self.doc_offsets is None:
+            return x, y
+        positions = starts[:, None] + np.arange(context_length)
+        return x, y, document_attention_mask(positions, self.doc_offsets).to(x.device)
+
+    def __iter__(self) -> Iterator[tuple[torch.Tensor, ...]]:
+        '''
+        iterates the next epoch
+        '''
+        epoch = self.epoch
+        self.epoch += 1
+        return self.iter_epoch(epoch)
+
+
+class BatchPrefetcher:
+    '''
+    samples batches like get_batch on a background thread and keeps up to prefetch of them ready in a queue,
+    so sampling and host-to-device copies overlap the training step.
+    batches come from one np.random.Generator seeded with seed, so the sequence does not depend on timing.
+    num_batches bounds the iteration, None iterates until close.
+    tracks how long the consumer waited (stall_time) and how full the queue was when each batch was taken
+    '''
+    def __init__(self, dataset: npt.NDArray, batch_size: int, context_length: int, device: str | torch.device,
+                 seed: int | None = None, prefetch: int = 4, num_batches: int | None = None):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.context_length = context_length
+        self.device = device
+        self.num_batches = num_batches
+        self.batches = 0
+        self.stall_time = 0.0
+        self.queue_depth_total = 0
+        self.empty_gets = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=prefetch)
+        self._stop = threading.Event()
+        self._rng = np.random.default_rng(seed)
+        self._thread = threading.Thread(target=self._produce, name='BatchPrefetcher', daemon=True)
+        self._thread.start()
+
+    def _put(self, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self):
+        produced = 0
+        try:
+            while self.num_batches is None or produced < self.num_batches:
+                batch = get_batch(self.dataset, self.batch_size, self.context_length, self.device, generator=self._rng)
+                if not self._put(batch):
+                    return
+                produced += 1
+            self._put(_END)
+        except BaseException as exc:
+            # re-raised on the consumer side by __next__
+            self._put(_ProducerError(exc))
+
+    def __iter__(self) -> 'BatchPrefetcher':
+        return self
+
+    def __next__(self) -> tuple[torch.Tensor, torch.Tensor]:
+        if self._stop.is_set():
+            raise StopIteration
+        depth = self._queue.qsize()
+        start = time.perf_counter()
+        item = self._queue.get()
+        self.stall_time += time.perf_counter() - start
+        if item is _END:
+            self.close()
+            raise StopIteration
+        if isinstance(item, _ProducerError):
+            self.close()
+            raise item.exc
+        self.batches += 1
+        self.queue_depth_total += depth
+        self.empty_gets += depth == 0
+        return item
+
+    def metrics(self) -> dict[str, float]:
+        '''
+        batches taken, total seconds spent waiting for them, mean queue depth when taken,
+        and the fraction of batches that were not ready yet
+        '''
+        return {
+            'batches': self.batches,
+            'stall_time': self.stall_time,
+            'mean_queue_depth': self.queue_depth_total / self.batches if self.batches else 0.0,
+            'stall_fraction': self.empty_gets / self.batches if self.batches else 0.0,
+        }
+
+    def close(self):
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._thread.join()
+        logger.info(f'prefetcher closed: {self.metrics()}')
+
+    def __enter__(self) -> 'BatchPrefetcher':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class _ProducerError:
+    __slots__ = ('exc',)
+
+    def __init__(self, exc: BaseException):
+        self.exc = exc
+
+
+# marks the end of a bounded prefetcher
+_END = object()
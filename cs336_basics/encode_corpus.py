@@ -0,0 +1,118 @@
+import logging
+import mmap
+import os
+import tempfile
+from multiprocessing import Pool
+from pathlib import Path
+
+import numpy as np
+
+from .bpe_tokenizer import BPETokenizer
+from .data import document_offsets
+from .special_tokens import SpecialTokenSplitter, get_splitter
+from .utils import find_chunk_boundaries
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 1 << 24
+
+# tokenizer of a pool worker, set once by _init_worker instead of being pickled with every chunk
+_worker_tokenizer: BPETokenizer | None = None
+
+def token_dtype(vocab_size: int) -> np.dtype:
+    '''
+    smallest unsigned dtype holding every id of a vocab of vocab_size tokens
+    '''
+    return np.dtype(np.uint32 if vocab_size > 65535 else np.uint16)
+
+def doc_offsets_path(output_path: str | os.PathLike) -> Path:
+    '''
+    sidecar of an encoded corpus: the start of every document in it, followed by the number of tokens
+    '''
+    return Path(f'{output_path}.docs.npy')
+
+def _init_worker(vocab: dict[int, bytes], merges: list[tuple[bytes, bytes]], special_tokens: list[str] | None):
+    global _worker_tokenizer
+    _worker_tokenizer = BPETokenizer.from_vocab_merges(vocab, merges, special_tokens)
+
+def _snap_boundaries(f, boundaries: list[int], splitter: SpecialTokenSplitter) -> list[int]:
+    '''
+    moves the inner boundaries to the end of the special token the tokenizer matches there, scanning the mapped file
+    with all of its special tokens (see SpecialTokenSplitter.snap_boundaries)
+    '''
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return splitter.snap_boundaries(mm, boundaries)
+
+def _encode_chunk(input_path: str, sta: int, end: int, dtype: np.dtype, shard_path: str) -> int:
+    '''
+    encodes the bytes [sta, end) of the file into shard_path, returns the number of tokens written
+    '''
+    with open(input_path, 'rb') as f:
+        f.seek(sta)
+        # chunks are cut right after a complete special token, so never inside a utf-8 character
+        text = f.read(end - sta).decode('utf-8')
+    ids = np.array(_worker_tokenizer.encode(text), dtype=dtype)
+    ids.tofile(shard_path)
+    return len(ids)
+
+def _encode_chunk_star(args: tuple) -> int:
+    return _encode_chunk(*args)
+
+def encode_corpus(tokenizer: BPETokenizer, input_path: str | os.PathLike, output_path: str | os.PathLike,
+                  split_special_token: str = '<|endoftext|>', num_workers: int | None = None,
+                  chunk_size: int | None = DEFAULT_CHUNK_SIZE) -> np.memmap:
+    '''
+    encodes a text file into a flat array of token ids saved at output_path, readable with
+    np.memmap(output_path, dtype=token_dtype(len(tokenizer.vocab)), mode='r').
+    the file is cut at split_special_token with find_chunk_boundaries, chunks are encoded by a pool
+    into temporary shards, which are then copied into a preallocated memmap at their offsets.
+    boundaries are then moved to the end of the special token the tokenizer matches there (see SpecialTokenSplitter.cut_after),
+    so every chunk splits like the whole file and the result is the same as encoding it at once.
+    the start of every document (the token after each split_special_token) is saved to doc_offsets_path(output_path)
+    '''
+    if split_special_token not in (tokenizer.special_tokens or []):
+        # cutting at text the tokenizer does not treat as special could split a pre-token across chunks
+        raise ValueError(f'{split_special_token!r} is not a special token of the tokenizer')
+    input_path = str(input_path)
+    output_path = Path(output_path)
+    num_workers = num_workers or os.cpu_count() or 1
+    dtype = token_dtype(len(tokenizer.vocab))
+    with open(input_path, 'rb') as f:
+        file_size = os.fstat(f.fileno()).st_size
+        num_chunks = BPETokenizer._num_chunks(file_size, num_workers, chunk_size)
+        boundaries = find_chunk_boundaries(f, num_chunks, split_special_token.encode('utf-8'))
+        if file_size:
+            boundaries = _snap_boundaries(f, boundaries, get_splitter(tuple(tokenizer.special_tokens)))
+    logger.info(f'encoding {input_path} in {len(boundaries) - 1} chunks with {num_workers} workers')
+
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=output_path.parent) as shard_dir:
+        tasks = [(input_path, sta, end, dtype, os.path.join(shard_dir, f'{idx}.bin'))
+                 for idx, (sta, end) in enumerate(zip(boundaries[:-1], boundaries[1:]))]
+        init_args = (tokenizer.vocab, tokenizer.merges, tokenizer.special_tokens)
+        if num_workers > 1 and len(tasks) > 1:
+            with Pool(num_workers, initializer=_init_worker, initargs=init_args) as pool:
+                lengths = pool.map(_encode_chunk_star, tasks)
+        else:
+            _init_worker(*init_args)
+            lengths = [_encode_chunk(*task) for task in tasks]
+
+        offsets = np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)])
+        total = int(offsets[-1])
+        # np.memmap cannot map an empty file
+        ids = np.memmap(output_path, dtype=dtype, mode='w+', shape=(max(total, 1),))
+        for task, sta, end in zip(tasks, offsets[:-1], offsets[1:]):
+            ids[sta:end] = np.fromfile(task[-1], dtype=dtype)
+        ids.flush()
+    if total == 0:
+        # drop the placeholder token, leaving an empty file
+        del ids
+        os.truncate(output_path, 0)
+        ids = np.zeros(0, dtype=dtype)
+    else:
+        ids = ids[:total]
+
+    doc_starts = document_offsets(ids, tokenizer.encoder.special_ids[split_special_token])
+    np.save(doc_offsets_path(output_path), doc_starts)
+    logger.info(f'wrote {total} tokens and {len(doc_starts) - 1} documents to {output_path}')
+    return ids
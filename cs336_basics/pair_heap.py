@@ -0,0 +1,83 @@
+import heapq
+from collections import Counter
+from collections.abc import Callable, Hashable, Mapping
+
+class _ReversedKey:
+    '''
+    inverts the ordering of the wrapped key, so that heapq (a min-heap) pops the lexicographically greatest pair first
+    '''
+    __slots__ = ('key',)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other: '_ReversedKey') -> bool:
+        return other.key < self.key
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, _ReversedKey) and self.key == other.key
+
+
+class PairHeap:
+    '''
+    max-heap of pair counts with lazy deletion.
+    pops the pair with the highest count, ties are broken by the greater pair, the same as
+    max(pair_counts, key=lambda pair: (pair_counts[pair], pair)).
+    stale entries are left in the heap and skipped when they reach the top.
+    tiebreak maps a pair to the value compared on ties, e.g. the bytes of a pair packed as vocab ids.
+    '''
+    def __init__(self, pair_counts: Mapping[Hashable, int], tiebreak: Callable | None = None):
+        self.counts: Counter = Counter({pair: count for pair, count in pair_counts.items() if count > 0})
+        self.tiebreak = tiebreak
+        self._rebuild()
+
+    def _entry(self, pair, count: int) -> tuple:
+        tie_key = self.tiebreak(pair) if self.tiebreak else pair
+        return (-count, _ReversedKey(tie_key), pair)
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    def __contains__(self, pair) -> bool:
+        return pair in self.counts
+
+    def update(self, pair_change_counter: Mapping[Hashable, int]):
+        '''
+        applies the count deltas returned by a merge, pairs whose count drops to 0 are removed
+        '''
+        for pair, delta in pair_change_counter.items():
+            if delta == 0:
+                continue
+            count = self.counts.get(pair, 0) + delta
+            if count <= 0:
+                self.counts.pop(pair, None)
+                continue
+            self.counts[pair] = count
+            heapq.heappush(self._heap, self._entry(pair, count))
+        if len(self._heap) > 2 * len(self.counts) + 1024:
+            self._rebuild()
+
+    def peek(self):
+        '''
+        returns the most frequent pair without removing it, None if the heap is empty
+        '''
+        while self._heap:
+            neg_count, _, pair = self._heap[0]
+            if self.counts.get(pair) == -neg_count:
+                return pair
+            heapq.heappop(self._heap)
+        return None
+
+    def pop(self):
+        '''
+        removes and returns the most frequent pair, None if the heap is empty
+        '''
+        pair = self.peek()
+        if pair is not None:
+            heapq.heappop(self._heap)
+            del self.counts[pair]
+        return pair
+
+    def _rebuild(self):
+        self._heap = [self._entry(pair, count) for pair, count in self.counts.items()]
+        heapq.heapify(self._heap)
@@ -0,0 +1,58 @@
+from collections import Counter
+from collections.abc import Hashable, Mapping
+
+class PairIndex(dict):
+    '''
+    inverted index from a pair to the pre-tokens containing it: {pair: Counter({token: occurrences})}.
+    occurrences are kept per token, so a token is only dropped from a pair once the last occurrence
+    of that pair in it is gone (e.g. merging (a, a) in "aaab" keeps the token under (a, b)).
+    empty entries are removed, so a pair is in the index iff some pre-token contains it.
+    '''
+    def add(self, token: Hashable, pair_counts: Mapping[Hashable, int]):
+        '''
+        adds occurrences of pairs in token
+        '''
+        for pair, occurrences in pair_counts.items():
+            if occurrences <= 0:
+                continue
+            tokens = self.get(pair)
+            if tokens is None:
+                tokens = self[pair] = Counter()
+            tokens[token] += occurrences
+
+    def remove(self, token: Hashable, pair_counts: Mapping[Hashable, int]):
+        '''
+        removes occurrences of pairs in token, pairs that are not indexed are ignored
+        '''
+        for pair, occurrences in pair_counts.items():
+            tokens = self.get(pair)
+            if tokens is None or token not in tokens:
+                continue
+            tokens[token] -= occurrences
+            if tokens[token] <= 0:
+                del tokens[token]
+                if not tokens:
+                    del self[pair]
+
+    def update_token(self, token: Hashable, old_pair_counts: Mapping[Hashable, int], new_pair_counts: Mapping[Hashable, int]):
+        '''
+        replaces the pairs indexed for token, only pairs whose occurrences changed are touched
+        '''
+        removed = Counter()
+        added = Counter()
+        for pair, occurrences in old_pair_counts.items():
+            change = new_pair_counts.get(pair, 0) - occurrences
+            if change < 0:
+                removed[pair] = -change
+        for pair, occurrences in new_pair_counts.items():
+            change = occurrences - old_pair_counts.get(pair, 0)
+            if change > 0:
+                added[pair] = change
+        self.remove(token, removed)
+        self.add(token, added)
+
+    def tokens(self, pair: Hashable) -> list:
+        '''
+        returns the tokens containing pair, as a list so the index can be updated while iterating
+        '''
+        return list(self.get(pair, ()))
@@ -0,0 +1,94 @@
+from functools import lru_cache
+
+import regex as re
+
+# ascii members of the unicode property classes the pre-tokenization pattern uses
+ASCII_PROPERTY_CLASSES = {'L': 'A-Za-z', 'N': '0-9'}
+
+def ascii_pattern(pattern: str) -> str | None:
+    '''
+    rewrites \\p{L} and \\p{N} in pattern as their ascii ranges, so it matches pure-ascii text exactly like pattern
+    without looking up unicode properties. returns None if pattern uses a property that can't be rewritten
+    '''
+    out = []
+    in_class = False
+    idx = 0
+    while idx < len(pattern):
+        char = pattern[idx]
+        if char == '\\':
+            if pattern[idx + 1:idx + 2] in ('p', 'P'):
+                close = pattern.find('}', idx)
+                name = pattern[idx + 3:close] if pattern[idx + 2:idx + 3] == '{' and close != -1 else None
+                # negated properties inside a class can't be expressed as a range
+                if name not in ASCII_PROPERTY_CLASSES or (pattern[idx + 1] == 'P' and in_class):
+                    return None
+                ranges = ASCII_PROPERTY_CLASSES[name]
+                if in_class:
+                    out.append(ranges)
+                else:
+                    out.append(('[^' if pattern[idx + 1] == 'P' else '[') + ranges + ']')
+                idx = close + 1
+                continue
+            out.append(pattern[idx:idx + 2])
+            idx += 2
+            continue
+        if char == '[' and not in_class:
+            in_class = True
+            out.append(char)
+            idx += 1
+            # a ] right after [ or [^ is a literal
+            if pattern[idx:idx + 1] == '^':
+                out.append('^')
+                idx += 1
+            if pattern[idx:idx + 1] == ']':
+                out.append(']')
+                idx += 1
+            continue
+        if char == ']' and in_class:
+            in_class = False
+        out.append(char)
+        idx += 1
+    return ''.join(out)
+
+
+class PretokenPattern:
+    '''
+    a pre-tokenization pattern compiled once, with an ascii variant used for text that is pure ascii
+    '''
+    def __init__(self, pattern: str):
+        self.pattern = pattern
+        self.compiled = re.compile(pattern)
+        ascii_source = ascii_pattern(pattern)
+        self.ascii_compiled = re.compile(ascii_source) if ascii_source and ascii_source != pattern else None
+
+    def _for(self, text: str) -> re.Pattern:
+        # str.isascii is O(1), CPython records it when the string is created
+        if self.ascii_compiled is not None and text.isascii():
+            return self.ascii_compiled
+        return self.compiled
+
+    def finditer(self, text: str):
+        return self._for(text).finditer(text)
+
+    def iter_pretokens(self, text: str):
+        '''
+        yields the pre-tokens of text one at a time, e.g. to stream them into a Counter without building a list
+        '''
+        return (re_match.group() for re_match in self._for(text).finditer(text))
+
+    def findall(self, text: str) -> list[str]:
+        '''
+        returns every pre-token in text, findall skips building a match object per pre-token
+        '''
+        compiled = self._for(text)
+        if compiled.groups:
+            return [re_match.group() for re_match in compiled.finditer(text)]
+        return compiled.findall(text)
+
+
+@lru_cache(maxsize=16)
+def get_pretoken_pattern(pattern: str) -> PretokenPattern:
+    '''
+    compiled pattern shared by everything in this process that pretokenizes with pattern
+    '''
+    return PretokenPattern(pattern)
@@ -0,0 +1,116 @@
+from collections.abc import Iterable
+from functools import lru_cache
+
+import regex as re
+
+class SpecialTokenSplitter:
+    '''
+    splits text at special tokens in a single scan with one precompiled pattern.
+    alternatives are ordered longest first, so where special tokens overlap
+    (e.g. <|endoftext|> and <|endoftext|><|endoftext|>) the longest one is matched
+    '''
+    def __init__(self, special_tokens: Iterable[str]):
+        self.special_tokens: tuple[str, ...] = tuple(dict.fromkeys(special_tokens))
+        self.pattern = None
+        self.bytes_pattern = None
+        self.token_bytes: tuple[bytes, ...] = tuple(token.encode('utf-8') for token in self.special_tokens)
+        if self.special_tokens:
+            ordered = sorted(self.special_tokens, key=len, reverse=True)
+            # the capturing group makes split keep the special tokens, at odd positions
+            self.pattern = re.compile('(' + '|'.join(map(re.escape, ordered)) + ')')
+            # the same scan over utf-8 bytes, e.g. a mapped file
+            self.bytes_pattern = re.compile(b'|'.join(map(re.escape, sorted(self.token_bytes, key=len, reverse=True))))
+        # proper prefixes of special tokens, text ending in one of them may still continue into a special token
+        self.prefixes: set[str] = {token[:end] for token in self.special_tokens for end in range(1, len(token))}
+        self.max_prefix = max(map(len, self.prefixes), default=0)
+
+    def __bool__(self) -> bool:
+        return self.pattern is not None
+
+    def split(self, text: str) -> list[str]:
+        '''
+        returns [text, special token, text, ...], text segments at even positions may be empty
+        '''
+        if self.pattern is None:
+            return [text]
+        return self.pattern.split(text)
+
+    def segments(self, text: str) -> list[str]:
+        '''
+        returns the non-empty text between special tokens, dropping the special tokens
+        '''
+        return [segment for segment in self.split(text)[::2] if segment]
+
+    def finditer(self, text: str):
+        if self.pattern is None:
+            return iter(())
+        return self.pattern.finditer(text)
+
+    def partial_suffix(self, text: str) -> int:
+        '''
+        returns the length of the longest suffix of text that is a proper prefix of a special token
+        '''
+        for length in range(min(self.max_prefix, len(text)), 0, -1):
+            if text[-length:] in self.prefixes:
+                return length
+        return 0
+
+    def _sync_point(self, buffer: bytes, pos: int) -> int:
+        '''
+        moves pos back until no occurrence of a special token straddles it. a scan from there finds
+        the same matches as a scan from the start of buffer, e.g. a run of <|endoftext|> pairs up
+        into <|endoftext|><|endoftext|> the same way
+        '''
+        longest = max(map(len, self.token_bytes))
+        while pos > 0:
+            window_start = max(0, pos - longest + 1)
+            straddling = pos
+            for token in self.token_bytes:
+                found = buffer.find(token, window_start, pos + len(token) - 1)
+                while found != -1 and found < pos:
+                    if found + len(token) > pos:
+                        straddling = min(straddling, found)
+                    found = buffer.find(token, found + 1, pos + len(token) - 1)
+            if straddling == pos:
+                return pos
+            pos = straddling
+        return 0
+
+    def finditer_bytes(self, buffer: bytes, pos: int = 0, end: int | None = None):
+        '''
+        yields the special token matches of a scan of buffer[:end] from its start that end after pos,
+        scanning only from a sync point before pos
+        '''
+        end = len(buffer) if end is None else end
+        if self.bytes_pattern is None:
+            return
+        for re_match in self.bytes_pattern.finditer(buffer, self._sync_point(buffer, pos), end):
+            if re_match.end() > pos:
+                yield re_match
+
+    def cut_after(self, buffer: bytes, pos: int, end: int | None = None) -> int:
+        '''
+        returns the end of the first special token match ending after pos, in a scan of buffer[:end] from its start,
+        or end if there is none. text cut there splits the same way as the whole buffer: the cut is after a complete
+        match, and so on a utf-8 character boundary
+        '''
+        end = len(buffer) if end is None else end
+        re_match = next(self.finditer_bytes(buffer, pos, end), None)
+        return re_match.end() if re_match is not None else end
+
+    def snap_boundaries(self, buffer: bytes, boundaries: list[int]) -> list[int]:
+        '''
+        moves every inner boundary of buffer to cut_after it, keeping the first and the last.
+        a boundary found by scanning for a single special token may fall inside a longer overlapping one,
+        e.g. between the halves of <|endoftext|><|endoftext|>
+        '''
+        inner = {self.cut_after(buffer, boundary) for boundary in boundaries[1:-1]}
+        return sorted({boundaries[0], boundaries[-1]} | inner)
+
+
+@lru_cache(maxsize=64)
+def get_splitter(special_tokens: tuple[str, ...]) -> SpecialTokenSplitter:
+    '''
+    splitter for special_tokens, compiled once per process however many windows are pretokenized with it
+    '''
+    return SpecialTokenSplitter(special_tokens)
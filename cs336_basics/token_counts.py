@@ -0,0 +1,113 @@
+import hashlib
+import json
+import os
+import pickle
+from array import array
+from collections import Counter
+from collections.abc import Sequence
+from multiprocessing.pool import Pool
+from pathlib import Path
+
+# a Counter[str] packed for the pool pipe: (utf-8 keys concatenated in sorted order, key lengths, counts)
+SerializedCounts = tuple[bytes, array, array]
+
+def serialize_counts(token_counts: Counter[str]) -> SerializedCounts:
+    keys = sorted(token.encode('utf-8') for token in token_counts)
+    lengths = array('I', map(len, keys))
+    counts = array('Q', (token_counts[key.decode('utf-8')] for key in keys))
+    return b''.join(keys), lengths, counts
+
+def _iter_serialized(serialized: SerializedCounts):
+    blob, lengths, counts = serialized
+    pos = 0
+    for length, count in zip(lengths, counts):
+        yield blob[pos:pos + length], count
+        pos += length
+
+def deserialize_counts(serialized: SerializedCounts) -> Counter[str]:
+    return Counter({key.decode('utf-8'): count for key, count in _iter_serialized(serialized)})
+
+def merge_serialized_counts(left: SerializedCounts, right: SerializedCounts) -> SerializedCounts:
+    '''
+    merges two serialized counters in one linear pass over their sorted keys
+    '''
+    keys = []
+    lengths = array('I')
+    counts = array('Q')
+
+    def emit(key: bytes, count: int):
+        keys.append(key)
+        lengths.append(len(key))
+        counts.append(count)
+
+    left_items = _iter_serialized(left)
+    right_items = _iter_serialized(right)
+    left_item = next(left_items, None)
+    right_item = next(right_items, None)
+    while left_item is not None and right_item is not None:
+        if left_item[0] < right_item[0]:
+            emit(*left_item)
+            left_item = next(left_items, None)
+        elif right_item[0] < left_item[0]:
+            emit(*right_item)
+            right_item = next(right_items, None)
+        else:
+            emit(left_item[0], left_item[1] + right_item[1])
+            left_item = next(left_items, None)
+            right_item = next(right_items, None)
+    for item, rest in ((left_item, left_items), (right_item, right_items)):
+        if item is not None:
+            emit(*item)
+            for key, count in rest:
+                emit(key, count)
+    return b''.join(keys), lengths, counts
+
+def _merge_serialized_counts_star(args: tuple[SerializedCounts, SerializedCounts]) -> SerializedCounts:
+    return merge_serialized_counts(*args)
+
+def tree_reduce_counts(results: Sequence[SerializedCounts], pool: Pool | None = None) -> SerializedCounts:
+    '''
+    merges serialized counters pairwise, level by level, running each level's merges in pool when given
+    '''
+    results = list(results)
+    if not results:
+        return b'', array('I'), array('Q')
+    while len(results) > 1:
+        pairs = list(zip(results[0::2], results[1::2]))
+        leftover = [results[-1]] if len(results) % 2 else []
+        if pool is not None:
+            merged = pool.map(_merge_serialized_counts_star, pairs)
+        else:
+            merged = [merge_serialized_counts(*pair) for pair in pairs]
+        results = merged + leftover
+    return results[0]
+
+def corpus_fingerprint(input_path: str | os.PathLike, pattern: str, special_tokens: list[str]) -> str:
+    '''
+    identifies the pre-token counts of a corpus: the file's path, size, mtime and content hash,
+    together with the pre-tokenization pattern and special tokens
+    '''
+    stat = os.stat(input_path)
+    with open(input_path, 'rb') as f:
+        content_hash = hashlib.file_digest(f, 'blake2b').hexdigest()
+    key = json.dumps([os.path.abspath(input_path), stat.st_size, stat.st_mtime_ns, content_hash, pattern, list(special_tokens)])
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+def load_cached_counts(cache_dir: str | os.PathLike, fingerprint: str) -> Counter[str] | None:
+    '''
+    returns the pre-token counts cached under fingerprint, None on a miss
+    '''
+    cache_path = Path(cache_dir) / f'{fingerprint}.pkl'
+    if not cache_path.exists():
+        return None
+    with open(cache_path, 'rb') as f:
+        return deserialize_counts(pickle.load(f))
+
+def save_cached_counts(cache_dir: str | os.PathLike, fingerprint: str, token_counts: Counter[str]):
+    cache_path = Path(cache_dir) / f'{fingerprint}.pkl'
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    # write to a temporary file first, so an interrupted run never leaves a truncated cache entry
+    tmp_path = cache_path.with_suffix(f'.{os.getpid()}.tmp')
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(serialize_counts(token_counts), f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, cache_path)
@@ -1,18 +1,43 @@
 import os
+import re
+import mmap
+from functools import lru_cache
 from typing import BinaryIO
 
+
+@lru_cache
+def _compile_split_tokens(split_special_tokens: tuple[bytes, ...]) -> re.Pattern[bytes]:
+    """
+    One pattern matching any of the special tokens, longest first, so a single scan finds
+    the earliest (and at the same position, the longest) special token.
+    """
+    ordered = sorted(set(split_special_tokens), key=lambda token: (-len(token), token))
+    return re.compile(b"|".join(map(re.escape, ordered)))
+
+
+def _as_token_tuple(split_special_token: bytes | list[bytes]) -> tuple[bytes, ...]:
+    tokens = (split_special_token,) if isinstance(split_special_token, bytes) else tuple(split_special_token)
+    assert tokens and all(isinstance(token, bytes) and token for token in tokens), (
+        "Must represent special tokens as non-empty bytestrings"
+    )
+    return tokens
+
 def find_chunk_boundaries(
     file: BinaryIO, # 以二进制模式打开的文件对象
     desired_num_chunks: int, 
-    split_special_token: bytes
+    split_special_token: bytes | list[bytes]
 ) -> list[int]:
     """
     Chunk the file into parts that can be counted independently.
+    Boundaries are placed at the first occurrence of any of the special tokens.
+    Where special tokens overlap, that occurrence may lie inside a longer one (e.g. <|a|> in zz<|a|>),
+    SpecialTokenSplitter.snap_boundaries moves boundaries past complete matches.
     May return fewer chunks if the boundaries end up overlapping.
     """
-    assert isinstance(split_special_token, bytes), (
-        "Must represent special token as a bytestring"
-    )
+    split_special_tokens = _as_token_tuple(split_special_token)
+    splitter = _compile_split_tokens(split_special_tokens)
+    # read past each mini chunk, so a token straddling two mini chunks is still found
+    overlap = max(map(len, split_special_tokens)) - 1
 
     # Get total file size in bytes
     file.seek(0, os.SEEK_END) # 用来移动文件的光标，决定下次一次读写的位置, 第一个参数表示偏移量，第二个参数表示参考位置。这行代码表示将光标移动到结尾位置
@@ -30,9 +55,9 @@ def find_chunk_boundaries(
 
     for bi in range(1, len(chunk_boundaries) - 1): # 遍历每一个猜测的边界
         initial_position = chunk_boundaries[bi] 
-        file.seek(initial_position)  # Start at boundary guess
         while True:
-            mini_chunk = file.read(mini_chunk_size)  # Read a mini chunk
+            file.seek(initial_position)  # Start at boundary guess
+            mini_chunk = file.read(mini_chunk_size + overlap)  # Read a mini chunk
 
             # If EOF, this boundary should be at the end of the file
             if mini_chunk == b"":
@@ -40,11 +65,33 @@ def find_chunk_boundaries(
                 break
 
             # Find the special token in the mini chunk
-            found_at = mini_chunk.find(split_special_token)
-            if found_at != -1:
-                chunk_boundaries[bi] = initial_position + found_at
+            found = splitter.search(mini_chunk)
+            if found is not None:
+                chunk_boundaries[bi] = initial_position + found.start()
                 break
             initial_position += mini_chunk_size
 
     # Make sure all boundaries are unique, but might be fewer than desired_num_chunks
-    return sorted(set(chunk_boundaries))
\ No newline at end of file
+    return sorted(set(chunk_boundaries))
+
+def find_chunk_boundaries_mmap(
+    mm: mmap.mmap | bytes,
+    desired_num_chunks: int,
+    split_special_token: bytes | list[bytes]
+) -> list[int]:
+    """
+    Same as find_chunk_boundaries, but scans a memory-mapped file in place
+    instead of reading it 4k bytes at a time.
+    """
+    splitter = _compile_split_tokens(_as_token_tuple(split_special_token))
+    file_size = len(mm)
+    chunk_size = file_size // desired_num_chunks
+
+    chunk_boundaries = [i * chunk_size for i in range(desired_num_chunks + 1)]
+    chunk_boundaries[-1] = file_size
+
+    for bi in range(1, len(chunk_boundaries) - 1):
+        found = splitter.search(mm, chunk_boundaries[bi])
+        chunk_boundaries[bi] = found.start() if found is not None else file_size
+
+    return sorted(set(chunk_boundaries))
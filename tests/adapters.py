@@ -106,7 +106,8 @@ def run_scaled_dot_product_attention(
     Returns:
         Float[Tensor, " ... queries d_v"]: Output of SDPA
     """
-    raise NotImplementedError
+    from cs336_basics import attention
+    return attention.scaled_dot_product_attention(Q, K, V, mask)
 
 
 def run_multihead_self_attention(
@@ -140,7 +141,10 @@ def run_multihead_self_attention(
         Float[Tensor, " ... sequence_length d_out"]: Tensor with the output of running your optimized, batched multi-headed attention
         implementation with the given QKV projection weights and input features.
     """
-    raise NotImplementedError
+    from cs336_basics import attention
+    return attention.multihead_self_attention(
+        in_features, q_proj_weight, k_proj_weight, v_proj_weight, o_proj_weight, num_heads
+    )
 
 
 def run_multihead_self_attention_with_rope(
@@ -180,7 +184,11 @@ def run_multihead_self_attention_with_rope(
         Float[Tensor, " ... sequence_length d_out"]: Tensor with the output of running your optimized, batched multi-headed attention
         implementation with the given QKV projection weights and input features.
     """
-    raise NotImplementedError
+    from cs336_basics import attention
+    return attention.multihead_self_attention(
+        in_features, q_proj_weight, k_proj_weight, v_proj_weight, o_proj_weight, num_heads,
+        theta=theta, token_positions=token_positions,
+    )
 
 
 def run_rope(
@@ -202,7 +210,8 @@ def run_rope(
     Returns:
         Float[Tensor, " ... sequence_length d_k"]: Tensor with RoPEd input.
     """
-    raise NotImplementedError
+    from cs336_basics import attention
+    return attention.rope(in_query_or_key, token_positions, theta)
 
 
 def run_transformer_block(
@@ -417,7 +426,8 @@ def run_get_batch(
         is the sampled input sequences, and the second tuple item is the corresponding
         language modeling labels.
     """
-    raise NotImplementedError
+    from cs336_basics import data
+    return data.get_batch(dataset, batch_size, context_length, device)
 
 
 def run_softmax(in_features: Float[Tensor, " ..."], dim: int) -> Float[Tensor, " ..."]:
@@ -559,7 +569,8 @@ def get_tokenizer(
     Returns:
         A BPE tokenizer that uses the provided vocab, merges, and special tokens.
     """
-    raise NotImplementedError
+    from cs336_basics import bpe_tokenizer
+    return bpe_tokenizer.BPETokenizer.from_vocab_merges(vocab, merges, special_tokens)
 
 
 def run_train_bpe(
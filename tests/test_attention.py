@@ -0,0 +1,100 @@
+import math
+
+import numpy as np
+import pytest
+import torch
+
+from cs336_basics.attention import KVCache, multihead_self_attention, scaled_dot_product_attention
+
+def naive_attention(Q, K, V, mask=None):
+    scores = Q @ K.transpose(-1, -2) / math.sqrt(Q.shape[-1])
+    if mask is not None:
+        scores = scores.masked_fill(~mask, -math.inf)
+    return torch.softmax(scores, dim=-1) @ V
+
+@pytest.mark.parametrize("block_size", [1, 3, 16, 64])
+def test_blocked_attention_matches_naive(q, k, v, mask, block_size):
+    expected = naive_attention(q, k, v, mask)
+    actual = scaled_dot_product_attention(q, k, v, mask, block_size=block_size)
+    np.testing.assert_allclose(actual.numpy(), expected.numpy(), atol=1e-6)
+
+@pytest.mark.parametrize("block_size", [1, 5, 64])
+def test_blocked_attention_causal(q, k, v, block_size):
+    causal = torch.ones(q.shape[-2], k.shape[-2], dtype=torch.bool).tril(k.shape[-2] - q.shape[-2])
+    expected = naive_attention(q, k, v, causal)
+    actual = scaled_dot_product_attention(q, k, v, is_causal=True, block_size=block_size)
+    np.testing.assert_allclose(actual.numpy(), expected.numpy(), atol=1e-6)
+
+def test_multihead_self_attention_matches_per_head(in_embeddings, d_model, n_heads):
+    torch.manual_seed(0)
+    weights = [torch.randn(d_model, d_model) / math.sqrt(d_model) for _ in range(4)]
+    actual = multihead_self_attention(in_embeddings, *weights, num_heads=n_heads, block_size=5)
+    q_w, k_w, v_w, o_w = weights
+    d_head = d_model // n_heads
+    seq = in_embeddings.shape[-2]
+    causal = torch.ones(seq, seq, dtype=torch.bool).tril()
+    heads = []
+    for head in range(n_heads):
+        rows = slice(head * d_head, (head + 1) * d_head)
+        Q, K, V = (in_embeddings @ w[rows].T for w in (q_w, k_w, v_w))
+        heads.append(naive_attention(Q, K, V, causal))
+    expected = torch.cat(heads, dim=-1) @ o_w.T
+    np.testing.assert_allclose(actual.numpy(), expected.numpy(), atol=1e-5)
+
+def test_blocked_attention_gradients(q, k, v, mask):
+    inputs = [x.clone().requires_grad_() for x in (q, k, v)]
+    scaled_dot_product_attention(*inputs, mask, block_size=5).sum().backward()
+    reference = [x.clone().requires_grad_() for x in (q, k, v)]
+    naive_attention(*reference, mask).sum().backward()
+    for actual, expected in zip(inputs, reference):
+        np.testing.assert_allclose(actual.grad.numpy(), expected.grad.numpy(), atol=1e-5)
+
+def test_blocked_attention_broadcast_mask(q, k, v):
+    key_mask = torch.arange(k.shape[-2]) % 3 != 0
+    expected = naive_attention(q, k, v, key_mask)
+    actual = scaled_dot_product_attention(q, k, v, key_mask[None, :], block_size=5)
+    np.testing.assert_allclose(actual.numpy(), expected.numpy(), atol=1e-6)
+
+def test_kv_cache_decoding_matches_full_forward(in_embeddings, d_model, n_heads, theta):
+    torch.manual_seed(0)
+    weights = [torch.randn(d_model, d_model) / math.sqrt(d_model) for _ in range(4)]
+    batch_size, seq, _ = in_embeddings.shape
+    expected = multihead_self_attention(in_embeddings, *weights, num_heads=n_heads, theta=theta)
+    cache = KVCache(batch_size, n_heads, seq, d_model // n_heads)
+    prefix = multihead_self_attention(in_embeddings[:, :5], *weights, num_heads=n_heads, theta=theta, kv_cache=cache)
+    steps = [
+        multihead_self_attention(in_embeddings[:, pos:pos + 1], *weights, num_heads=n_heads, theta=theta, kv_cache=cache)
+        for pos in range(5, seq)
+    ]
+    np.testing.assert_allclose(torch.cat([prefix] + steps, dim=1).numpy(), expected.numpy(), atol=1e-5)
+    assert cache.length == seq
+    with pytest.raises(ValueError):
+        cache.append(cache.keys[..., :1, :], cache.values[..., :1, :])
+
+def test_rope_positions_with_explicit_token_positions(in_embeddings, d_model, n_heads, theta):
+    torch.manual_seed(0)
+    weights = [torch.randn(d_model, d_model) / math.sqrt(d_model) for _ in range(4)]
+    positions = torch.arange(3, 3 + in_embeddings.shape[-2])
+    shifted = multihead_self_attention(in_embeddings, *weights, num_heads=n_heads, theta=theta, token_positions=positions)
+    unshifted = multihead_self_attention(in_embeddings, *weights, num_heads=n_heads, theta=theta)
+    # attention only depends on relative positions
+    np.testing.assert_allclose(shifted.numpy(), unshifted.numpy(), atol=1e-5)
+
+def test_kv_cache_rejects_mismatched_inputs(in_embeddings, d_model, n_heads):
+    torch.manual_seed(0)
+    weights = [torch.randn(d_model, d_model) / math.sqrt(d_model) for _ in range(4)]
+    batch_size, seq, _ = in_embeddings.shape
+    d_head = d_model // n_heads
+    mismatched = [
+        KVCache(batch_size + 1, n_heads, seq, d_head),
+        KVCache(batch_size, n_heads * 2, seq, d_head // 2),
+        KVCache(batch_size, n_heads, seq, d_head * 2),
+        KVCache(batch_size, n_heads, seq, d_head, dtype=torch.float64),
+    ]
+    for cache in mismatched:
+        with pytest.raises(ValueError, match="KVCache"):
+            multihead_self_attention(in_embeddings, *weights, num_heads=n_heads, theta=10000.0, kv_cache=cache)
+        assert cache.length == 0
+    cache = KVCache(batch_size, n_heads, seq, d_head)
+    with pytest.raises(ValueError, match="positions"):
+        cache.append(torch.zeros(batch_size, n_heads, 2, d_head), torch.zeros(batch_size, n_heads, 3, d_head))
@@ -0,0 +1,28 @@
+import pytest
+from cs336_basics import BPETokenizer
+from cs336_basics.bpe_checkpoint import list_merge_checkpoints, load_latest_merge_checkpoint
+from .common import FIXTURES_PATH
+
+@pytest.mark.parametrize("int_ids", [False, True])
+def test_resume_from_checkpoint(tmp_path, int_ids):
+    input_path = str(FIXTURES_PATH / "tinystories_sample.txt")
+    special_tokens = ["<|endoftext|>"]
+    reference = BPETokenizer(400, special_tokens)
+    reference.train(input_path, parallel=False, int_ids=int_ids)
+
+    # a run that stops early leaves its latest checkpoint behind
+    interrupted = BPETokenizer(340, special_tokens)
+    interrupted.train(input_path, parallel=False, int_ids=int_ids, checkpoint_dir=tmp_path, checkpoint_every=25)
+    assert [path.name for path in list_merge_checkpoints(tmp_path)] == ["merge_00000050.pkl", "merge_00000075.pkl"]
+    assert len(load_latest_merge_checkpoint(tmp_path)["merges"]) == 75
+
+    resumed = BPETokenizer(400, special_tokens)
+    resumed.train(input_path, parallel=False, int_ids=int_ids, checkpoint_dir=tmp_path, checkpoint_every=25)
+    assert resumed.merges == reference.merges
+    assert resumed.vocab == reference.vocab
+
+def test_checkpoint_from_other_setting_is_rejected(tmp_path):
+    input_path = str(FIXTURES_PATH / "tinystories_sample.txt")
+    BPETokenizer(300, ["<|endoftext|>"]).train(input_path, parallel=False, checkpoint_dir=tmp_path, checkpoint_every=10)
+    with pytest.raises(ValueError):
+        BPETokenizer(350, ["<|endoftext|>"]).train(input_path, parallel=False, int_ids=True, checkpoint_dir=tmp_path)
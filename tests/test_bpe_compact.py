@@ -0,0 +1,36 @@
+from collections import Counter
+from cs336_basics import CompactTokenTable, pack_pair, unpack_pair
+
+def ids(token: bytes) -> list[int]:
+    return list(token)
+
+def test_pack_pair_roundtrip():
+    assert unpack_pair(pack_pair(3, 70000)) == (3, 70000)
+    assert pack_pair(1, 0) > pack_pair(0, 2 ** 32 - 1)
+
+def test_table_init_and_pair_frequency():
+    table = CompactTokenTable(Counter({'abc': 2, 'bcd': 3}))
+    assert [list(word) for word in table.words] == [ids(b'abc'), ids(b'bcd')]
+    assert list(table.counts) == [2, 3]
+    assert table.pair_frequency() == Counter({
+        pack_pair(ord('a'), ord('b')): 2,
+        pack_pair(ord('b'), ord('c')): 5,
+        pack_pair(ord('c'), ord('d')): 3,
+    })
+    assert table.pair2words[pack_pair(ord('b'), ord('c'))] == {0: 1, 1: 1}
+
+def test_table_byte_offset():
+    table = CompactTokenTable(Counter({'ab': 1}), byte_offset=1)
+    assert list(table.words[0]) == [ord('a') + 1, ord('b') + 1]
+
+def test_merge_repeated_pair():
+    a, b, aa = ord('a'), ord('b'), 256
+    table = CompactTokenTable(Counter({'aaaa': 2, 'aaab': 1}))
+    pair_change_counter = table.merge(pack_pair(a, a), aa)
+    assert [list(word) for word in table.words] == [[aa, aa], [aa, a, b]]
+    assert +pair_change_counter == Counter({pack_pair(aa, aa): 2, pack_pair(aa, a): 1})
+    assert -pair_change_counter == Counter()
+    assert pack_pair(a, a) not in table.pair2words
+    assert table.pair2words[pack_pair(aa, aa)] == {0: 1}
+    assert table.pair2words[pack_pair(a, b)] == {1: 1}
+    assert table.pair_frequency() == Counter({pack_pair(aa, aa): 2, pack_pair(aa, a): 1, pack_pair(a, b): 1})
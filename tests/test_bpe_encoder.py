@@ -0,0 +1,89 @@
+import random
+
+import numpy as np
+import pytest
+import regex as re
+from cs336_basics import BPETokenizer, LRUCache
+from .common import FIXTURES_PATH
+
+def replay_merges(token_bytes: bytes, merges: list[tuple[bytes, bytes]]) -> list[bytes]:
+    bytes_list = [bytes([byte]) for byte in token_bytes]
+    for pair in merges:
+        bytes_list = BPETokenizer._merge_bytes_list(bytes_list, pair)
+    return bytes_list
+
+def test_encode_matches_replaying_merges():
+    input_path = FIXTURES_PATH / "tinystories_sample.txt"
+    tokenizer = BPETokenizer(400, ["<|endoftext|>"])
+    tokenizer.train(str(input_path), parallel=False)
+    text = input_path.read_text()
+    for re_match in re.finditer(tokenizer.PAT, text.replace("<|endoftext|>", "")):
+        token_bytes = re_match.group().encode('utf-8')
+        expected = replay_merges(token_bytes, tokenizer.merges)
+        assert [tokenizer.vocab[idx] for idx in tokenizer.encoder.encode_pretoken(token_bytes)] == expected
+
+def test_encode_repeated_symbols():
+    vocab = {idx: bytes([idx]) for idx in range(256)}
+    vocab[256] = b'aa'
+    vocab[257] = b'aaaa'
+    tokenizer = BPETokenizer.from_vocab_merges(vocab, [(b'a', b'a'), (b'aa', b'aa')], ["<|endoftext|>"])
+    assert tokenizer.vocab[258] == b"<|endoftext|>"
+    assert tokenizer.encode("aaaaa<|endoftext|>aaa") == [257, ord('a'), 258, 256, ord('a')]
+    assert tokenizer.decode([257, 258]) == "aaaa<|endoftext|>"
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(2)
+    cache.put('a', (1,))
+    cache.put('b', (2,))
+    assert cache.get('a') == (1,)
+    cache.put('c', (3,))
+    assert 'b' not in cache and 'a' in cache and 'c' in cache
+    assert cache.get('b') is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def test_encode_cache_does_not_change_output():
+    input_path = FIXTURES_PATH / "tinystories_sample.txt"
+    vocab = {idx: bytes([idx]) for idx in range(256)}
+    vocab[256] = b' t'
+    vocab[257] = b' th'
+    merges = [(b' ', b't'), (b' t', b'h')]
+    text = input_path.read_text()
+    cached = BPETokenizer.from_vocab_merges(vocab, merges, ["<|endoftext|>"], cache_size=16)
+    uncached = BPETokenizer.from_vocab_merges(vocab, merges, ["<|endoftext|>"], cache_size=0)
+    assert cached.encode(text) == uncached.encode(text)
+    assert len(cached.encoder.cache) == 16
+    assert cached.encoder.cache.hits > 0
+    assert len(uncached.encoder.cache) == 0
+
+def test_encode_iterable_matches_encode_on_any_split():
+    input_path = FIXTURES_PATH / "tinystories_sample.txt"
+    tokenizer = BPETokenizer(400, ["<|endoftext|>", "<|endoftext|><|endoftext|>"])
+    tokenizer.train(str(input_path), parallel=False)
+    text = input_path.read_text() + "  \n\n <|endoftext|><|endoftext|><|endoftext|>don't  "
+    rng = random.Random(0)
+    for _ in range(5):
+        cuts = sorted(rng.sample(range(1, len(text)), 200))
+        chunks = [text[sta:end] for sta, end in zip([0] + cuts, cuts + [len(text)])]
+        assert list(tokenizer.encode_iterable(iter(chunks))) == tokenizer.encode(text)
+    assert list(tokenizer.encode_iterable(text)) == tokenizer.encode(text)
+
+def test_decode_array_and_batch():
+    vocab = {idx: bytes([idx]) for idx in range(256)}
+    vocab[256] = 'é'.encode('utf-8')
+    vocab[257] = b'abc'
+    tokenizer = BPETokenizer.from_vocab_merges(vocab, [], ["<|endoftext|>"])
+    ids = [257, 256, 258, 32, 0xC3, 257]
+    expected = "abcé<|endoftext|> �abc"
+    assert tokenizer.decode(ids) == expected
+    assert tokenizer.decode(np.array(ids, dtype=np.uint16)) == expected
+    assert tokenizer.decode(np.array([], dtype=np.uint16)) == ""
+    batch = np.array([[257, 256], [258, 0xC3], [32, 32]], dtype=np.uint16)
+    assert tokenizer.decode_batch(batch) == ["abcé", "<|endoftext|>�", "  "]
+    assert tokenizer.decode_batch([[257], [], [256]]) == ["abc", "", "é"]
+    for bad_ids in ([259], [-1], [257, -3, 256]):
+        with pytest.raises(KeyError):
+            tokenizer.decode(np.array(bad_ids))
+        with pytest.raises(KeyError):
+            tokenizer.decode(bad_ids)
+        with pytest.raises(KeyError):
+            tokenizer.decode_batch([[257], bad_ids])
@@ -0,0 +1,29 @@
+import pickle
+from collections import Counter
+from cs336_basics import BPETokenizer, CompactTokenTable, pack_pair
+from cs336_basics.bpe_sharded import ShardedTokenTable
+from .common import FIXTURES_PATH
+
+def test_sharded_merge_matches_single_table():
+    token_counts = Counter({'aaaa': 2, 'aaab': 1, 'abab': 3, 'ba': 4, 'b': 1})
+    a, b = ord('a'), ord('b')
+    table = CompactTokenTable(token_counts)
+    with ShardedTokenTable.from_token_counts(token_counts, 0, 3) as sharded:
+        assert sharded.num_shards == 3
+        assert sharded.pair_frequency() == table.pair_frequency()
+        for key, new_id in ((pack_pair(a, a), 256), (pack_pair(a, b), 257), (pack_pair(b, a), 258)):
+            expected = Counter({pair: change for pair, change in table.merge(key, new_id).items() if change})
+            assert sharded.merge(key, new_id) == expected
+        restored = pickle.loads(pickle.dumps(sharded))
+    assert isinstance(restored, CompactTokenTable)
+    assert sorted(map(list, restored.words)) == sorted(map(list, table.words))
+    assert restored.pair_frequency() == table.pair_frequency()
+
+def test_train_with_merge_workers():
+    input_path = str(FIXTURES_PATH / "tinystories_sample.txt")
+    reference = BPETokenizer(400, ["<|endoftext|>"])
+    reference.train(input_path, parallel=False, int_ids=True)
+    sharded = BPETokenizer(400, ["<|endoftext|>"])
+    sharded.train(input_path, parallel=False, int_ids=True, merge_workers=3)
+    assert sharded.merges == reference.merges
+    assert sharded.vocab == reference.vocab
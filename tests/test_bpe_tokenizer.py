@@ -1,5 +1,6 @@
-from collections import Counter, defaultdict
-from cs336_basics import BPETokenizer
+from collections import Counter
+from cs336_basics import BPETokenizer, PairIndex
+from .common import FIXTURES_PATH
 
 def test_reform_tokens_counts():
     token_counts = Counter({
@@ -17,28 +18,28 @@ def test_reform_tokens_counts():
         b',n,nzh': ([b',', b'n', b',', b'n', b'z', b'h'], 2),
     }
     expected_pair2tokens = {
-    (b'a', b'b'): {b'abc'},
-    (b'b', b'c'): {b'abc', b'bcd'}, 
-    (b'c', b'd'): {b'bcd'},
-    (b's', b'a'): {b'sadebzkjhg'},
-    (b'a', b'd'): {b'sadebzkjhg'},
-    (b'd', b'e'): {b'sadebzkjhg'},
-    (b'e', b'b'): {b'sadebzkjhg'},
-    (b'b', b'z'): {b'sadebzkjhg'},
-    (b'z', b'k'): {b'sadebzkjhg'},
-    (b'k', b'j'): {b'sadebzkjhg'},
-    (b'j', b'h'): {b'sadebzkjhg'},
-    (b'h', b'g'): {b'sadebzkjhg'},
-    (b',', b'z'): {b',zncmvk'},
-    (b'z', b'n'): {b',zncmvk'},
-    (b'n', b'c'): {b',zncmvk'},
-    (b'c', b'm'): {b',zncmvk'},
-    (b'm', b'v'): {b',zncmvk'},
-    (b'v', b'k'): {b',zncmvk'},
-    (b',', b'n'): {b',n,nzh'}, 
-    (b'n', b','): {b',n,nzh'},
-    (b'n', b'z'): {b',n,nzh'},
-    (b'z', b'h'): {b',n,nzh'},
+    (b'a', b'b'): {b'abc': 1},
+    (b'b', b'c'): {b'abc': 1, b'bcd': 1}, 
+    (b'c', b'd'): {b'bcd': 1},
+    (b's', b'a'): {b'sadebzkjhg': 1},
+    (b'a', b'd'): {b'sadebzkjhg': 1},
+    (b'd', b'e'): {b'sadebzkjhg': 1},
+    (b'e', b'b'): {b'sadebzkjhg': 1},
+    (b'b', b'z'): {b'sadebzkjhg': 1},
+    (b'z', b'k'): {b'sadebzkjhg': 1},
+    (b'k', b'j'): {b'sadebzkjhg': 1},
+    (b'j', b'h'): {b'sadebzkjhg': 1},
+    (b'h', b'g'): {b'sadebzkjhg': 1},
+    (b',', b'z'): {b',zncmvk': 1},
+    (b'z', b'n'): {b',zncmvk': 1},
+    (b'n', b'c'): {b',zncmvk': 1},
+    (b'c', b'm'): {b',zncmvk': 1},
+    (b'm', b'v'): {b',zncmvk': 1},
+    (b'v', b'k'): {b',zncmvk': 1},
+    (b',', b'n'): {b',n,nzh': 2}, 
+    (b'n', b','): {b',n,nzh': 1},
+    (b'n', b'z'): {b',n,nzh': 1},
+    (b'z', b'h'): {b',n,nzh': 1},
 }
     
     token_counts_reformed, pair2tokens = BPETokenizer._reform_tokens_counts(token_counts)
@@ -53,15 +54,15 @@ def test_merge_and_side_effects():
         token1: ([b'a', b'b', b'c', b'd'], 5),
         token2: ([b'b', b'c', b'b', b'c'], 3)
     }
-    pair2tokens = defaultdict(set)
-    pair2tokens.update(
-        {
-        (b'a', b'b'): {token1},
-        (b'b', b'c'): {token1, token2}, 
-        (b'c', b'd'): {token1},
-        (b'c', b'b'): {token2},
-        }
-    )
+    pair2tokens = PairIndex()
+    pair2tokens.add(token1, BPETokenizer.count_pair(token1))
+    pair2tokens.add(token2, BPETokenizer.count_pair(token2))
+    assert pair2tokens == {
+        (b'a', b'b'): {token1: 1},
+        (b'b', b'c'): {token1: 1, token2: 2},
+        (b'c', b'd'): {token1: 1},
+        (b'c', b'b'): {token2: 1},
+    }
     
     pair_to_merge = (b'b', b'c')
     
@@ -86,12 +87,107 @@ def test_merge_and_side_effects():
     assert token_counts == expected_token_counts
 
     expected_pair2tokens = {
-        (b'a', b'b'): set(),
-        (b'bc', b'b'): set(),
-        (b'c', b'b'): set(),
-        (b'c', b'd'): set(),
-        (b'a', b'bc'): {token1}, 
-        (b'bc', b'd'): {token1}, 
-        (b'bc', b'bc'): {token2}, 
+        (b'a', b'bc'): {token1: 1},
+        (b'bc', b'd'): {token1: 1},
+        (b'bc', b'bc'): {token2: 1},
     }
     assert pair2tokens == expected_pair2tokens
+
+
+def test_merge_repeated_pair():
+    token1 = b'aaa'
+    token2 = b'aaaab'
+    token_counts, pair2tokens = BPETokenizer._reform_tokens_counts(Counter({'aaa': 2, 'aaaab': 1}))
+    assert pair2tokens[(b'a', b'a')] == {token1: 2, token2: 3}
+
+    pair_change_counter = BPETokenizer._merge_pair_token_counts(token_counts, pair2tokens, (b'a', b'a'))
+
+    assert pair_change_counter == Counter({
+        (b'aa', b'a'): 2,
+        (b'aa', b'aa'): 1,
+        (b'a', b'b'): -1,
+        (b'aa', b'b'): 1,
+    })
+    assert token_counts == {
+        token1: ([b'aa', b'a'], 2),
+        token2: ([b'aa', b'aa', b'b'], 1),
+    }
+    assert pair2tokens == {
+        (b'aa', b'a'): {token1: 1},
+        (b'aa', b'aa'): {token2: 1},
+        (b'aa', b'b'): {token2: 1},
+    }
+
+def test_iter_windows_cut_before_special_tokens():
+    data = b'ab<|endoftext|>cdef<|endoftext|>g<|endoftext|>hijklmnopq'
+    windows = list(BPETokenizer._iter_windows(data, 0, len(data), 4, ['<|endoftext|>']))
+    assert b''.join(windows) == data
+    assert windows[0] == b'ab'
+    for window in windows[1:]:
+        assert window.startswith(b'<|endoftext|>')
+
+def test_streaming_pretokenize_matches_whole_chunk():
+    input_path = FIXTURES_PATH / "tinystories_sample.txt"
+    special_tokens = ['<|endoftext|>']
+    pattern = BPETokenizer(500, special_tokens).PAT
+    with open(input_path, 'rb') as f:
+        data = f.read()
+    expected = BPETokenizer.pretokenize_binary(data, pattern, special_tokens)
+    for window_size in (64, 1024, len(data)):
+        token_counts = BPETokenizer._parallel_pretokenize_worker(input_path, pattern, special_tokens, 0, len(data), window_size)
+        assert token_counts == expected
+
+def test_streaming_pretokenize_windows_overlapping_special_tokens(tmp_path):
+    special_tokens = ['<|a|>', 'zz<|a|>']
+    data = b'hello world zz<|a|>' * 200
+    input_path = tmp_path / 'overlapping.txt'
+    input_path.write_bytes(data)
+    pattern = BPETokenizer(500, special_tokens).PAT
+    expected = BPETokenizer.pretokenize_binary(data, pattern, special_tokens)
+    for window_size in (7, 19, 50):
+        windows = list(BPETokenizer._iter_windows(data, 0, len(data), window_size, special_tokens))
+        assert b''.join(windows) == data
+        assert all(window.startswith(b'zz<|a|>') for window in windows[1:])
+        assert BPETokenizer._parallel_pretokenize_worker(input_path, pattern, special_tokens, 0, len(data), window_size) == expected
+
+def test_num_chunks():
+    assert BPETokenizer._num_chunks(1000, 4) == 16
+    assert BPETokenizer._num_chunks(1000, 4, chunk_size=300) == 4
+    assert BPETokenizer._num_chunks(0, 4, chunk_size=300) == 1
+
+def test_pretokenize_parallel_with_small_chunks():
+    input_path = FIXTURES_PATH / "tinystories_sample.txt"
+    special_tokens = ['<|endoftext|>']
+    pattern = BPETokenizer(500, special_tokens).PAT
+    with open(input_path, 'rb') as f:
+        expected = BPETokenizer.pretokenize_binary(f.read(), pattern, special_tokens)
+    token_counts = BPETokenizer.pretokenize_parallel(input_path, pattern, special_tokens, num_workers=2, chunk_size=256)
+    assert token_counts == expected
+
+def test_iter_windows_packs_documents_up_to_window_size():
+    data = b'a<|endoftext|>b<|endoftext|>c' * 4
+    windows = list(BPETokenizer._iter_windows(data, 0, len(data), 40, ['<|endoftext|>']))
+    assert b''.join(windows) == data
+    assert all(len(window) <= 40 for window in windows)
+    assert len(windows) < data.count(b'<|endoftext|>')
+
+def test_serial_and_parallel_pretokenize_agree():
+    input_path = FIXTURES_PATH / "tinystories_sample.txt"
+    special_tokens = ['<|endoftext|>', '<|pad|>']
+    pattern = BPETokenizer(500, special_tokens).PAT
+    serial = BPETokenizer.pretokenize(input_path, pattern, special_tokens, num_workers=2, chunk_size=512)
+    parallel = BPETokenizer.pretokenize_parallel(input_path, pattern, special_tokens, num_workers=2, chunk_size=512)
+    assert serial == parallel
+    assert all('<|' not in token for token in serial)
+
+def test_serial_and_parallel_pretokenize_agree_on_overlapping_special_tokens(tmp_path):
+    # <|a|> is a suffix of zz<|a|>, a chunk must not start between zz and <|a|>
+    special_tokens = ['<|a|>', 'zz<|a|>']
+    data = b'hello world zz<|a|>' * 200
+    input_path = tmp_path / 'overlapping.txt'
+    input_path.write_bytes(data)
+    pattern = BPETokenizer(500, special_tokens).PAT
+    expected = BPETokenizer.pretokenize_binary(data, pattern, special_tokens)
+    for chunk_size in (7, 37, 101):
+        assert BPETokenizer.pretokenize(input_path, pattern, special_tokens, num_workers=2, chunk_size=chunk_size) == expected
+        assert BPETokenizer.pretokenize_parallel(input_path, pattern, special_tokens, num_workers=2, chunk_size=chunk_size) == expected
@@ -1,5 +1,9 @@
-from cs336_basics import Word
+import pickle
+import random
+from cs336_basics import BPETokenizer, CompactTokenTable, Word, WordBatch
+from cs336_basics.bpe_word import SymbolTable
 from collections import Counter
+from .common import FIXTURES_PATH
 
 def test_init_bytes_list():
     word = Word(b"abracadabra")
@@ -121,3 +125,92 @@ def test_pair_count():
     })
     
     assert Word.count_pair(word.bytes_repr) == expected_counter
+
+def test_word_batch_matches_word_merge():
+    rng = random.Random(0)
+    words = [bytes(rng.choice(b'ab') for _ in range(rng.randint(0, 9))) for _ in range(200)] + [b'banana', b'aaaa', b'']
+    counts = [rng.randint(1, 5) for _ in words]
+    batch = WordBatch.from_bytes(words, counts)
+    symbols = {byte: bytes([byte]) for byte in range(256)}
+    word_objs = [Word(word) for word in words]
+    for pair in [(b'a', b'a'), (b'a', b'b'), (b'b', b'ab'), (b'aa', b'aa'), (b'ab', b'b')]:
+        ids = {symbol: idx for idx, symbol in symbols.items()}
+        new_id = len(symbols)
+        symbols[new_id] = pair[0] + pair[1]
+        pair_changes = batch.merge(ids[pair[0]], ids[pair[1]], new_id)
+
+        expected_changes = Counter()
+        for word, count in zip(word_objs, counts):
+            old_pairs = Counter(zip(word.bytes_list[:-1], word.bytes_list[1:]))
+            word.merge(pair)
+            expected_changes.update({p: c * count for p, c in Counter(zip(word.bytes_list[:-1], word.bytes_list[1:])).items()})
+            expected_changes.subtract({p: c * count for p, c in old_pairs.items()})
+        expected_changes.pop(pair, None)
+        assert [[symbols[idx] for idx in word] for word in batch.get_symbol_lists()] == [word.bytes_list for word in word_objs]
+        assert {(symbols[key >> 32], symbols[key & 0xFFFFFFFF]): change for key, change in pair_changes.items()} == \
+            {p: c for p, c in expected_changes.items() if c}
+
+def test_word_batch_keeps_pair_counts_over_many_merges():
+    rng = random.Random(1)
+    words = [bytes(rng.choice(b'abcd') for _ in range(rng.randint(0, 12))) for _ in range(300)]
+    counts = [rng.randint(1, 5) for _ in words]
+    batch = WordBatch.from_bytes(words, counts)
+    symbols = {byte: bytes([byte]) for byte in range(256)}
+    word_objs = [Word(word, SymbolTable()) for word in words]
+    pair_counts = batch.pair_counts()
+    for new_id in range(256, 316):
+        key = max(pair_counts, key=lambda key: (pair_counts[key], key))
+        left, right = key >> 32, key & 0xFFFFFFFF
+        symbols[new_id] = symbols[left] + symbols[right]
+        pair_counts.update(batch.merge(left, right, new_id))
+        del pair_counts[key]
+        for word in word_objs:
+            word.merge((symbols[left], symbols[right]))
+        assert +pair_counts == batch.pair_counts()
+    assert [[symbols[idx] for idx in word] for word in batch.get_symbol_lists()] == [word.bytes_list for word in word_objs]
+    # a pair no word holds anymore
+    assert batch.merge(ord('a'), ord('a'), 999) == Counter()
+
+def test_word_batch_pickles_as_compact_table():
+    token_counts = Counter({'aaaa': 2, 'aaab': 1, 'ba': 4})
+    batch = WordBatch.from_bytes([token.encode() for token in token_counts], list(token_counts.values()), byte_offset=1)
+    table = CompactTokenTable(token_counts, byte_offset=1)
+    batch.merge(ord('a') + 1, ord('a') + 1, 300)
+    table.merge((ord('a') + 1) << 32 | ord('a') + 1, 300)
+    restored = pickle.loads(pickle.dumps(batch))
+    assert isinstance(restored, CompactTokenTable)
+    assert list(map(list, restored.words)) == list(map(list, table.words))
+    assert WordBatch.from_words(restored.words, restored.counts).pair_counts() == +table.pair_frequency()
+
+def test_train_with_batch_merge(tmp_path):
+    input_path = str(FIXTURES_PATH / "tinystories_sample.txt")
+    reference = BPETokenizer(400, ["<|endoftext|>"])
+    reference.train(input_path, parallel=False, int_ids=True)
+    batched = BPETokenizer(400, ["<|endoftext|>"])
+    batched.train(input_path, parallel=False, int_ids=True, batch_merge=True)
+    assert batched.merges == reference.merges and batched.vocab == reference.vocab
+
+    BPETokenizer(340, ["<|endoftext|>"]).train(input_path, parallel=False, int_ids=True, batch_merge=True,
+                                                checkpoint_dir=tmp_path, checkpoint_every=25)
+    resumed = BPETokenizer(400, ["<|endoftext|>"])
+    resumed.train(input_path, parallel=False, int_ids=True, batch_merge=True, checkpoint_dir=tmp_path, checkpoint_every=25)
+    assert resumed.merges == reference.merges and resumed.vocab == reference.vocab
+
+def test_word_batch_pair_counts():
+    batch = WordBatch.from_bytes([b'aaa', b'ab'], [2, 3])
+    a, b = ord('a'), ord('b')
+    assert batch.pair_counts() == Counter({(a << 32) | a: 4, (a << 32) | b: 3})
+
+def test_words_share_one_symbol_table_of_merged_symbols():
+    table = SymbolTable()
+    first, second = Word(b"abab", table), Word(b"abc", table)
+    first.merge((b'a', b'b'))
+    second.merge((b'a', b'b'))
+    assert first.bytes_list == [b'ab', b'ab'] and second.bytes_list == [b'ab', b'c']
+    # single bytes are implicit, only the merged symbol is stored
+    assert len(table) == 257 and table.symbols == [b'ab']
+
+    unrelated = Word(b"abab")
+    unrelated.merge((b'b', b'a'))
+    assert unrelated.symbol_table is None and len(table) == 257
+    assert unrelated.bytes_list == [b'a', b'ba', b'b'] and unrelated.bytes_repr == b"abab"
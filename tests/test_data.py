@@ -3,6 +3,15 @@ from collections import Counter
 
 import numpy as np
 import pytest
+import torch
+
+from cs336_basics.data import (
+    BatchPrefetcher,
+    PackedSequenceSampler,
+    PinnedStaging,
+    document_offsets,
+    get_batch,
+)
 
 from .adapters import run_get_batch
 
@@ -70,3 +79,97 @@ def test_get_batch():
             device="cuda:99",
         )
         assert "CUDA error" in str(excinfo.value) or "Torch not compiled with CUDA enabled" in str(excinfo.value)
+
+
+def test_get_batch_memmap(tmp_path):
+    path = tmp_path / "tokens.bin"
+    np.arange(1000, dtype=np.uint16).tofile(path)
+    dataset = np.memmap(path, dtype=np.uint16, mode="r")
+    x, y = get_batch(dataset, 16, 9, "cpu", generator=np.random.default_rng(0))
+    assert x.dtype == torch.long and x.shape == (16, 9)
+    assert torch.equal(x + 1, y)
+    assert torch.equal(x - x[:, :1], torch.arange(9).expand(16, 9))
+    assert x.is_contiguous() and y.is_contiguous()
+    assert y.view(-1).shape == (16 * 9,)
+    assert x.untyped_storage().data_ptr() != y.untyped_storage().data_ptr()
+    x_again, _ = get_batch(dataset, 16, 9, "cpu", generator=np.random.default_rng(0))
+    assert torch.equal(x, x_again)
+
+
+def test_batch_prefetcher_is_seeded_and_bounded():
+    dataset = np.arange(0, 500)
+    with BatchPrefetcher(dataset, 8, 5, "cpu", seed=3, prefetch=2, num_batches=6) as prefetcher:
+        batches = list(prefetcher)
+    rng = np.random.default_rng(3)
+    expected = [get_batch(dataset, 8, 5, "cpu", generator=rng) for _ in range(6)]
+    assert len(batches) == 6
+    for (x, y), (expected_x, expected_y) in zip(batches, expected):
+        assert torch.equal(x, expected_x) and torch.equal(y, expected_y)
+    metrics = prefetcher.metrics()
+    assert metrics["batches"] == 6
+    assert metrics["stall_time"] >= 0 and 0 <= metrics["mean_queue_depth"] <= 2
+
+
+def test_batch_prefetcher_reraises_producer_errors():
+    with pytest.raises(AssertionError):
+        next(iter(BatchPrefetcher(np.arange(0, 5), 8, 10, "cpu")))
+
+
+def test_document_offsets():
+    dataset = np.array([5, 1, 0, 7, 0, 3, 3, 0])
+    assert document_offsets(dataset, 0).tolist() == [0, 3, 5, 8]
+    assert document_offsets(dataset, 0, block_size=3).tolist() == [0, 3, 5, 8]
+    assert document_offsets(dataset[:6], 0).tolist() == [0, 3, 5, 6]
+
+
+def test_packed_sampler_covers_each_token_once_per_epoch():
+    dataset = np.arange(0, 101)
+    sampler = PackedSequenceSampler(dataset, batch_size=3, context_length=7, device="cpu", seed=0)
+    first_epoch = list(sampler)
+    assert len(first_epoch) == len(sampler) == 6
+    # 14 full windows, then the 2 inputs left over as a shorter window
+    assert first_epoch[-1][0].tolist() == [[98, 99]] and first_epoch[-1][1].tolist() == [[99, 100]]
+    inputs = torch.cat([x.flatten() for x, _ in first_epoch])
+    labels = torch.cat([y.flatten() for _, y in first_epoch])
+    assert sorted(inputs.tolist()) == list(range(100))
+    assert sorted(labels.tolist()) == list(range(1, 101))
+    assert all(torch.equal(x + 1, y) for x, y in first_epoch)
+    assert torch.equal(torch.cat([x.flatten() for x, _ in sampler.iter_epoch(0)]), inputs)
+    assert not torch.equal(torch.cat([x.flatten() for x, _ in sampler]), inputs)
+
+def test_packed_sampler_without_tail():
+    sampler = PackedSequenceSampler(np.arange(0, 99), batch_size=4, context_length=7, device="cpu", seed=0)
+    batches = list(sampler)
+    assert len(batches) == len(sampler) == 4 and all(x.shape[1] == 7 for x, _ in batches)
+    assert sorted(torch.cat([x.flatten() for x, _ in batches]).tolist()) == list(range(98))
+
+
+def test_packed_sampler_document_masks():
+    eot = 99
+    dataset = np.array([1, 2, eot, 3, 4, 5, eot, 6, 7])
+    sampler = PackedSequenceSampler(dataset, batch_size=1, context_length=8, device="cpu", eot_id=eot)
+    ((x, y, mask),) = list(sampler)
+    doc = torch.tensor([0, 0, 0, 1, 1, 1, 1, 2])
+    expected = torch.ones(8, 8, dtype=torch.bool).tril() & (doc[:, None] == doc[None, :])
+    assert torch.equal(mask[0], expected)
+
+
+def test_packed_sampler_tail_document_mask():
+    eot = 99
+    # 10 inputs over windows of 4: two full windows, then a tail of positions 8 and 9 on both sides of an eot
+    dataset = np.array([1, 2, eot, 3, 4, 5, 6, 7, eot, 8, 9])
+    sampler = PackedSequenceSampler(dataset, batch_size=1, context_length=4, device="cpu", eot_id=eot)
+    *_, (x, y, mask) = list(sampler)
+    assert x.tolist() == [[eot, 8]] and y.tolist() == [[8, 9]]
+    assert mask[0].tolist() == [[True, False], [False, True]]
+
+
+@pytest.mark.skipif(not torch.cuda.is_available(), reason="pinned staging needs cuda")
+def test_pinned_staging_reuses_buffer():
+    staging = PinnedStaging()
+    first = staging.to_device(np.arange(12).reshape(3, 4), torch.device("cuda"))
+    buffer = staging.buffers[(3, 4)][0]
+    second = staging.to_device(np.arange(12, 24).reshape(3, 4), torch.device("cuda"))
+    assert staging.buffers[(3, 4)][0] is buffer and buffer.is_pinned()
+    assert first.tolist() == np.arange(12).reshape(3, 4).tolist()
+    assert second.tolist() == np.arange(12, 24).reshape(3, 4).tolist()
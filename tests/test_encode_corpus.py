@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from cs336_basics import BPETokenizer
+from cs336_basics.encode_corpus import doc_offsets_path, encode_corpus, token_dtype
+from .common import FIXTURES_PATH
+
+@pytest.fixture(scope="module")
+def tokenizer():
+    tokenizer = BPETokenizer(400, ["<|endoftext|>"])
+    tokenizer.train(str(FIXTURES_PATH / "tinystories_sample.txt"), parallel=False)
+    return tokenizer
+
+@pytest.mark.parametrize("num_workers", [1, 2])
+def test_encode_corpus_matches_serial_encode(tokenizer, tmp_path, num_workers):
+    input_path = FIXTURES_PATH / "tinystories_sample.txt"
+    output_path = tmp_path / "tokens.bin"
+    ids = encode_corpus(tokenizer, input_path, output_path, num_workers=num_workers, chunk_size=2048)
+    expected = tokenizer.encode(input_path.read_text())
+    assert ids.dtype == np.uint16
+    assert ids.tolist() == expected
+    assert np.memmap(output_path, dtype=np.uint16, mode="r").tolist() == expected
+
+    eot = tokenizer.encoder.special_ids["<|endoftext|>"]
+    doc_starts = np.load(doc_offsets_path(output_path))
+    assert doc_starts[0] == 0 and doc_starts[-1] == len(expected)
+    assert all(expected[start - 1] == eot for start in doc_starts[1:-1])
+    assert len(doc_starts) - 2 == expected.count(eot) - (expected[-1] == eot)
+
+def test_encode_corpus_requires_special_split_token(tokenizer, tmp_path):
+    with pytest.raises(ValueError):
+        encode_corpus(tokenizer, FIXTURES_PATH / "corpus.en", tmp_path / "tokens.bin", split_special_token="\n")
+
+def test_token_dtype():
+    assert token_dtype(50257) == np.uint16
+    assert token_dtype(65536) == np.uint32
+
+@pytest.mark.parametrize("chunk_size", [37, 50, 100, 2048])
+def test_encode_corpus_overlapping_special_tokens(tmp_path, chunk_size):
+    special_tokens = ["<|endoftext|>", "<|endoftext|><|endoftext|>"]
+    tokenizer = BPETokenizer(300, special_tokens)
+    tokenizer.train(str(FIXTURES_PATH / "tinystories_sample.txt"), parallel=False)
+    text = (FIXTURES_PATH / "tinystories_sample.txt").read_text()[:3000]
+    text = text.replace("<|endoftext|>", "<|endoftext|><|endoftext|><|endoftext|>") + "é<|endoftext|><|endoftext|>ü"
+    input_path = tmp_path / "corpus.txt"
+    input_path.write_text(text)
+    ids = encode_corpus(tokenizer, input_path, tmp_path / "tokens.bin", num_workers=1, chunk_size=chunk_size)
+    assert ids.tolist() == tokenizer.encode(text)
@@ -0,0 +1,48 @@
+import random
+from collections import Counter
+from cs336_basics import PairHeap
+
+def test_pop_order_matches_max():
+    pair_counts = Counter({
+        (b'a', b'b'): 3,
+        (b'b', b'c'): 5,
+        (b'c', b'd'): 5,
+        (b' ', b't'): 5,
+        (b'x', b'y'): 1,
+    })
+    heap = PairHeap(pair_counts)
+    popped = []
+    while len(heap):
+        expected = max(pair_counts, key=lambda pair: (pair_counts[pair], pair))
+        pair_counts.pop(expected)
+        popped.append(heap.pop())
+        assert popped[-1] == expected
+    assert heap.pop() is None
+
+def test_update_with_deltas():
+    heap = PairHeap({(b'a', b'b'): 4, (b'b', b'c'): 2})
+    heap.update(Counter({(b'a', b'b'): -3, (b'b', b'c'): 1, (b'c', b'd'): 3}))
+    assert heap.counts == Counter({(b'a', b'b'): 1, (b'b', b'c'): 3, (b'c', b'd'): 3})
+    assert heap.pop() == (b'c', b'd')
+    assert heap.pop() == (b'b', b'c')
+    heap.update(Counter({(b'a', b'b'): -1}))
+    assert (b'a', b'b') not in heap
+    assert heap.pop() is None
+
+def test_random_updates_match_max():
+    rng = random.Random(0)
+    symbols = [bytes([c]) for c in b'abcdef']
+    pair_counts = Counter({(rng.choice(symbols), rng.choice(symbols)): rng.randint(1, 20) for _ in range(30)})
+    heap = PairHeap(pair_counts)
+    for _ in range(200):
+        deltas = Counter({(rng.choice(symbols), rng.choice(symbols)): rng.randint(-5, 5) for _ in range(5)})
+        heap.update(deltas)
+        for pair, delta in deltas.items():
+            pair_counts[pair] += delta
+            if pair_counts[pair] <= 0:
+                pair_counts.pop(pair)
+        assert heap.counts == pair_counts
+        if pair_counts:
+            expected = max(pair_counts, key=lambda pair: (pair_counts[pair], pair))
+            assert heap.pop() == expected
+            pair_counts.pop(expected)
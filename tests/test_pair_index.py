@@ -0,0 +1,41 @@
+from collections import Counter
+from cs336_basics import PairIndex
+
+def test_add_and_remove_with_occurrences():
+    index = PairIndex()
+    index.add(b'aaab', Counter({(b'a', b'a'): 2, (b'a', b'b'): 1}))
+    index.add(b'ab', Counter({(b'a', b'b'): 1}))
+    assert index == {
+        (b'a', b'a'): {b'aaab': 2},
+        (b'a', b'b'): {b'aaab': 1, b'ab': 1},
+    }
+    index.remove(b'aaab', Counter({(b'a', b'a'): 1}))
+    assert index[(b'a', b'a')] == {b'aaab': 1}
+    index.remove(b'aaab', Counter({(b'a', b'a'): 1, (b'x', b'y'): 1}))
+    assert (b'a', b'a') not in index
+    index.remove(b'ab', Counter({(b'a', b'b'): 1}))
+    assert index == {(b'a', b'b'): {b'aaab': 1}}
+
+def test_update_token_only_touches_changed_pairs():
+    index = PairIndex()
+    index.add(b'aaaa', Counter({(b'a', b'a'): 3}))
+    # merging (a, a) in aaaa gives [aa, aa]
+    index.update_token(b'aaaa', Counter({(b'a', b'a'): 3}), Counter({(b'aa', b'aa'): 1}))
+    assert index == {(b'aa', b'aa'): {b'aaaa': 1}}
+
+    index.add(b'abab', Counter({(b'a', b'b'): 2, (b'b', b'a'): 1}))
+    # merging (b, a) in abab gives [a, ba, b], (a, b) is no longer present
+    index.update_token(b'abab', Counter({(b'a', b'b'): 2, (b'b', b'a'): 1}), Counter({(b'a', b'ba'): 1, (b'ba', b'b'): 1}))
+    assert (b'a', b'b') not in index
+    assert (b'b', b'a') not in index
+    assert index[(b'a', b'ba')] == {b'abab': 1}
+
+def test_tokens_is_a_snapshot():
+    index = PairIndex()
+    index.add(b'ab', Counter({(b'a', b'b'): 1}))
+    index.add(b'cab', Counter({(b'a', b'b'): 1}))
+    tokens = index.tokens((b'a', b'b'))
+    for token in tokens:
+        index.remove(token, Counter({(b'a', b'b'): 1}))
+    assert sorted(tokens) == [b'ab', b'cab']
+    assert index.tokens((b'a', b'b')) == []
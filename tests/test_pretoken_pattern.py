@@ -0,0 +1,30 @@
+import regex as re
+
+from cs336_basics import BPETokenizer
+from cs336_basics.pretoken_pattern import ascii_pattern, get_pretoken_pattern
+from .common import FIXTURES_PATH
+
+PAT = BPETokenizer(300).PAT
+
+def test_ascii_pattern_rewrites_property_classes():
+    assert ascii_pattern(PAT) == r"""'(?:[sdmt]|ll|ve|re)| ?[A-Za-z]+| ?[0-9]+| ?[^\sA-Za-z0-9]+|\s+(?!\S)|\s+"""
+    assert ascii_pattern(r"\P{L}") == "[^A-Za-z]"
+    assert ascii_pattern(r"[\P{L}]") is None
+    assert ascii_pattern(r"\p{Lu}") is None
+
+def test_ascii_fast_path_matches_unicode_pattern():
+    pretoken_pattern = get_pretoken_pattern(PAT)
+    assert pretoken_pattern.ascii_compiled is not None
+    for name in ["corpus.en", "tinystories_sample.txt", "address.txt"]:
+        text = (FIXTURES_PATH / name).read_text()
+        ascii_text = text.encode("ascii", errors="ignore").decode("ascii") + "\x1c 12ab\t\n x"
+        expected = [re_match.group() for re_match in re.finditer(PAT, ascii_text)]
+        assert pretoken_pattern.findall(ascii_text) == expected
+        assert pretoken_pattern.findall(text) == [re_match.group() for re_match in re.finditer(PAT, text)]
+
+def test_iter_pretokens_matches_findall():
+    pretoken_pattern = get_pretoken_pattern(PAT)
+    text = (FIXTURES_PATH / "tinystories_sample.txt").read_text()
+    pretokens = pretoken_pattern.iter_pretokens(text)
+    assert not isinstance(pretokens, list)
+    assert list(pretokens) == pretoken_pattern.findall(text)
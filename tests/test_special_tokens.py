@@ -0,0 +1,39 @@
+from cs336_basics.special_tokens import SpecialTokenSplitter, get_splitter
+
+def test_split_prefers_longest_special_token():
+    splitter = SpecialTokenSplitter(["<|endoftext|>", "<|endoftext|><|endoftext|>"])
+    text = "a<|endoftext|><|endoftext|>b<|endoftext|>"
+    assert splitter.split(text) == ["a", "<|endoftext|><|endoftext|>", "b", "<|endoftext|>", ""]
+    assert splitter.segments(text) == ["a", "b"]
+
+def test_split_without_special_tokens():
+    splitter = SpecialTokenSplitter([])
+    assert not splitter
+    assert splitter.split("a<|endoftext|>") == ["a<|endoftext|>"]
+    assert list(splitter.finditer("a<|endoftext|>")) == []
+
+def test_partial_suffix():
+    splitter = SpecialTokenSplitter(["<|endoftext|>", "<|endoftext|><|endoftext|>"])
+    assert splitter.partial_suffix("hello <|end") == len("<|end")
+    assert splitter.partial_suffix("hello<|endoftext|>") == len("<|endoftext|>")
+    assert splitter.partial_suffix("hello") == 0
+
+def test_get_splitter_is_cached():
+    assert get_splitter(("<|endoftext|>",)) is get_splitter(("<|endoftext|>",))
+
+def test_cut_after_lands_on_serial_match_ends():
+    splitter = SpecialTokenSplitter(["<|endoftext|>", "<|endoftext|><|endoftext|>"])
+    eot = b"<|endoftext|>"
+    buffer = b"ab" + eot * 3 + b"cd"
+    match_ends = {2 + 2 * len(eot), 2 + 3 * len(eot), len(buffer)}
+    for pos in range(len(buffer)):
+        assert splitter.cut_after(buffer, pos) in match_ends
+    assert splitter.cut_after(buffer, 5) == 2 + 2 * len(eot)
+    assert SpecialTokenSplitter([]).cut_after(buffer, 5) == len(buffer)
+
+def test_finditer_bytes_matches_a_full_scan():
+    splitter = SpecialTokenSplitter(["<|a|>", "zz<|a|>"])
+    buffer = b"hello zz<|a|> x<|a|>" * 3
+    full = [(m.start(), m.end()) for m in splitter.finditer_bytes(buffer)]
+    for pos in range(len(buffer)):
+        assert [(m.start(), m.end()) for m in splitter.finditer_bytes(buffer, pos)] == [span for span in full if span[1] > pos]
@@ -0,0 +1,50 @@
+from collections import Counter
+from multiprocessing import Pool
+from cs336_basics import BPETokenizer
+from cs336_basics.token_counts import (
+    corpus_fingerprint, deserialize_counts, load_cached_counts, merge_serialized_counts, save_cached_counts, serialize_counts,
+    tree_reduce_counts,
+)
+
+def test_serialize_roundtrip():
+    token_counts = Counter({' the': 3, 'a': 1, 'été': 2, '': 1})
+    assert deserialize_counts(serialize_counts(token_counts)) == token_counts
+    assert deserialize_counts(serialize_counts(Counter())) == Counter()
+
+def test_merge_serialized_counts():
+    left = Counter({'a': 1, 'b': 2, 'd': 4})
+    right = Counter({'b': 3, 'c': 1, 'e': 5, 'f': 1})
+    merged = merge_serialized_counts(serialize_counts(left), serialize_counts(right))
+    assert deserialize_counts(merged) == left + right
+    blob, lengths, counts = merged
+    assert len(lengths) == len(counts) == 6
+
+def test_tree_reduce_counts():
+    counters = [Counter({str(i % 3): i, 'x': 1}) for i in range(7)]
+    expected = sum(counters, Counter())
+    serialized = [serialize_counts(counter) for counter in counters]
+    assert deserialize_counts(tree_reduce_counts(serialized)) == expected
+    with Pool(2) as p:
+        assert deserialize_counts(tree_reduce_counts(serialized, p)) == expected
+    assert deserialize_counts(tree_reduce_counts([])) == Counter()
+
+def test_pretokenize_cache(tmp_path):
+    corpus = tmp_path / 'corpus.txt'
+    corpus.write_text('hello world<|endoftext|>hello there')
+    pattern = BPETokenizer(300).PAT
+    fingerprint = corpus_fingerprint(corpus, pattern, ['<|endoftext|>'])
+    assert corpus_fingerprint(corpus, pattern, ['<|endoftext|>', '<|pad|>']) != fingerprint
+    assert load_cached_counts(tmp_path / 'cache', fingerprint) is None
+
+    BPETokenizer(300, ['<|endoftext|>']).train(str(corpus), parallel=False, cache_dir=tmp_path / 'cache')
+    cached = load_cached_counts(tmp_path / 'cache', fingerprint)
+    assert cached == Counter({'hello': 2, ' world': 1, ' there': 1})
+
+    # a cache hit skips pretokenization, so poisoned cached counts show up in the merges
+    save_cached_counts(tmp_path / 'cache', fingerprint, Counter({'zz': 5}))
+    bpe = BPETokenizer(258, ['<|endoftext|>'])
+    bpe.train(str(corpus), parallel=False, cache_dir=tmp_path / 'cache')
+    assert bpe.merges == [(b'z', b'z')]
+
+    corpus.write_text('hello world<|endoftext|>hello again')
+    assert corpus_fingerprint(corpus, pattern, ['<|endoftext|>']) != fingerprint
@@ -0,0 +1,23 @@
+import io
+import mmap
+from cs336_basics.utils import find_chunk_boundaries, find_chunk_boundaries_mmap
+from .common import FIXTURES_PATH
+
+def test_mmap_boundaries_match_file_boundaries():
+    input_path = FIXTURES_PATH / "tinystories_sample.txt"
+    with open(input_path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for desired_num_chunks in (1, 3, 8, 64):
+                expected = find_chunk_boundaries(f, desired_num_chunks, b"<|endoftext|>")
+                assert find_chunk_boundaries_mmap(mm, desired_num_chunks, b"<|endoftext|>") == expected
+
+def test_boundaries_split_on_any_special_token():
+    data = (b'x' * 10 + b'<|a|>' + b'y' * 10 + b'<|bb|>' + b'z' * 10)
+    boundaries = find_chunk_boundaries_mmap(data, 4, [b'<|a|>', b'<|bb|>'])
+    assert boundaries == [0, 10, 25, len(data)]
+    assert find_chunk_boundaries_mmap(data, 4, b'<|bb|>') == [0, 25, len(data)]
+
+def test_file_boundaries_find_token_across_reads():
+    data = b'x' * 4094 + b'<|endoftext|>' + b'y' * 100
+    with io.BytesIO(data) as f:
+        assert find_chunk_boundaries(f, 2, [b'<|endoftext|>', b'<|pad|>']) == [0, 4094, len(data)]